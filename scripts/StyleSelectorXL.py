@@ -3,181 +3,2084 @@ import contextlib
 import gradio as gr
 from modules import scripts, shared, script_callbacks
 from modules.ui_components import FormRow, FormColumn, FormGroup, ToolButton
+import bisect
+import csv
+import gzip
+import hashlib
+import heapq
+import io
+import itertools
 import json
+import math
+import mmap
+import operator
 import os
 import random
+import re
+import struct
 import subprocess
 import platform
+import sys
+import threading
+import zlib
+from array import array
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
 
 stylespath = ""
 current_language = "default"
 
+_GZIP_MAGIC = b"\x1f\x8b"
+_ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+STYLE_FILE_TYPES = [".json", ".gz", ".zst"]
+
+
+def style_file_compression(file_path):
+    """依檔頭判斷樣式檔的壓縮格式：'gzip'、'zstd' 或 None"""
+    with open(file_path, 'rb') as file:
+        head = file.read(4)
+    if head.startswith(_GZIP_MAGIC):
+        return "gzip"
+    if head == _ZSTD_MAGIC:
+        return "zstd"
+    return None
+
+
+def open_style_file(file_path, mode='rt', compression=None):
+    """
+    開啟樣式檔（支援 .json.gz / .json.zst），以串流方式解壓縮，不寫出暫存檔。
+    寫入新檔案時可用 compression（'gzip'/'zstd'）指定格式，否則沿用既有檔案的格式。
+    """
+    if compression is None and ('r' in mode or os.path.exists(file_path)):
+        compression = style_file_compression(file_path)
+    binary = 'b' in mode
+    if compression == "gzip":
+        return gzip.open(file_path, mode, encoding=None if binary else "utf-8")
+    if compression == "zstd":
+        if zstandard is None:
+            raise RuntimeError("Reading .zst style files requires the 'zstandard' package")
+        raw = open(file_path, 'rb' if 'r' in mode else 'wb')
+        if 'r' in mode:
+            stream = zstandard.ZstdDecompressor().stream_reader(raw, closefd=True)
+        else:
+            stream = zstandard.ZstdCompressor().stream_writer(raw, closefd=True)
+        return stream if binary else io.TextIOWrapper(stream, encoding="utf-8")
+    return open(file_path, mode, encoding=None if binary else "utf-8")
+
+
+def pack_basename(file_path):
+    """樣式檔名稱去掉 .json / .gz / .zst 副檔名"""
+    name = os.path.basename(file_path)
+    for suffix in (".gz", ".zst", ".json"):
+        if name.lower().endswith(suffix):
+            name = name[:-len(suffix)]
+    return name
+
+
 def get_json_content(file_path):
     try:
-        with open(file_path, 'rt', encoding="utf-8") as file:
+        with open_style_file(file_path) as file:
             json_data = json.load(file)
             return json_data
     except Exception as e:
         print(f"A Problem occurred: {str(e)}")
 
 
+def read_style_pack(file_path):
+    """逐項讀取樣式檔（v1/v2，可壓縮），直接串流進樣式庫而不先建立整份 JSON"""
+    with open_style_file(file_path) as file:
+        yield from iter_pack_items(file)
+
+
+
+def _split_categories(category_str):
+    """支援多值（逗號分隔）的category字串"""
+    if not category_str:
+        return []
+    return [cat.strip() for cat in category_str.split(',') if cat.strip()]
+
+
+_CATEGORY_OPERATORS = re.compile(r"([&|!()])")
+CATEGORY_EXPRESSION_CACHE_SIZE = 256
+
+
+def compile_category_expression(text):
+    """
+    解析 Random Category 的布林運算式，例如 "photo & !anime | cinematic"（! 優先於 &，& 優先於 |，可用括號）。
+    回傳巢狀 tuple：("category", 名稱)、("not", 子式)、("and"/"or", [子式...])；
+    不含任何運算子時回傳 None（一般的單一category），語法錯誤時拋出 ValueError。
+    """
+    if not _CATEGORY_OPERATORS.search(text):
+        return None
+    tokens = [token.strip() for token in _CATEGORY_OPERATORS.split(text)]
+    tokens = [token for token in tokens if token]
+    position = 0
+
+    def parse_or():
+        nonlocal position
+        terms = [parse_and()]
+        while position < len(tokens) and tokens[position] == "|":
+            position += 1
+            terms.append(parse_and())
+        return terms[0] if len(terms) == 1 else ("or", terms)
+
+    def parse_and():
+        nonlocal position
+        factors = [parse_not()]
+        while position < len(tokens) and tokens[position] == "&":
+            position += 1
+            factors.append(parse_not())
+        return factors[0] if len(factors) == 1 else ("and", factors)
+
+    def parse_not():
+        nonlocal position
+        if position >= len(tokens):
+            raise ValueError(f"Unexpected end of category expression '{text}'")
+        token = tokens[position]
+        position += 1
+        if token == "!":
+            return ("not", parse_not())
+        if token == "(":
+            node = parse_or()
+            if position >= len(tokens) or tokens[position] != ")":
+                raise ValueError(f"Missing ')' in category expression '{text}'")
+            position += 1
+            return node
+        if token in "&|)":
+            raise ValueError(f"Unexpected '{token}' in category expression '{text}'")
+        return ("category", token)
+
+    node = parse_or()
+    if position != len(tokens):
+        raise ValueError(f"Unexpected '{tokens[position]}' in category expression '{text}'")
+    return node
+
+
+_SIGNATURE_BINS = 32
+_SIGNATURE_BAND_ROWS = 2
+_SIGNATURE_BANDS = _SIGNATURE_BINS // _SIGNATURE_BAND_ROWS
+_EMPTY_SIGNATURE = bytes(_SIGNATURE_BINS * 2)
+# 共用 band key 的兩個樣式還要有這麼多個 bin 相同（估計的 Jaccard 相似度約 0.3）才併為同一群；
+# 只憑一個 band 就合併會讓不同群經由少數共同標籤串成一大群
+_SIGNATURE_MIN_EQUAL_BINS = 10
+# 每個 band key 只和最早出現的幾個樣式比較，避免大群在分群時退化成兩兩比較
+_SIGNATURE_BUCKET_PROBES = 8
+_TAG_SEPARATORS = re.compile(r"[,\n()\[\]{}|:]+")
+
+
+def style_signature(prompt):
+    """
+    模板 prompt 的 MinHash 簽章：每個標籤以 blake2b 雜湊一次，切成 32 個 16 位元的值，
+    每個位置取所有標籤中的最小值，回傳 64 bytes（原生位元組順序，可直接附加到 array('H')）。
+    每 2 個位置組成一個 band key。
+    沒有任何標籤的 prompt 簽章全為 0，分群時自成一群。
+    """
+    rows = []
+    if isinstance(prompt, str):
+        for tag in _TAG_SEPARATORS.split(prompt.replace('{prompt}', ' ').lower()):
+            tag = " ".join(tag.split())
+            if tag:
+                digest = hashlib.blake2b(tag.encode("utf-8"), digest_size=_SIGNATURE_BINS * 2).digest()
+                rows.append(struct.unpack(f"{_SIGNATURE_BINS}H", digest))
+    if not rows:
+        return _EMPTY_SIGNATURE
+    return struct.pack(f"{_SIGNATURE_BINS}H", *map(min, zip(*rows)))
+
+
+_KEYWORD_TOKEN = re.compile(r"[^\W_]{2,}")
+KEYWORD_TERMS_PER_STYLE = 32
+KEYWORD_VOCABULARY_LIMIT = 1 << 16
+KEYWORD_MAX_DOCUMENT_FREQUENCY = 0.5
+
+
+def keyword_tokens(text):
+    """關鍵字索引使用的詞：小寫、至少兩個字元、不含純數字與 {prompt}"""
+    if not isinstance(text, str):
+        return []
+    return [token for token in _KEYWORD_TOKEN.findall(text.replace('{prompt}', ' ').lower()) if not token.isdigit()]
+
+
+class KeywordIndex:
+    """
+    樣式模板文字（prompt 與 negative_prompt）的 BM25 關鍵字索引：詞 -> (樣式 slot 陣列, 詞頻陣列)。
+    prompt 中的詞權重為 negative_prompt 的兩倍；每個樣式最多保留 KEYWORD_TERMS_PER_STYLE 個詞，
+    出現在太多樣式中的詞不建立索引，詞彙超過上限時只保留最常見的詞，記憶體大致與樣式數成正比。
+    """
+    K1 = 1.2
+    B = 0.75
+
+    def __init__(self, records):
+        postings = {}
+        lengths = []
+        for slot, record in enumerate(records):
+            length, counts = self._terms(record)
+            lengths.append(length)
+            for token, count in counts.items():
+                entry = postings.get(token)
+                if entry is None:
+                    entry = postings[token] = (array('I'), array('B'))
+                entry[0].append(slot)
+                entry[1].append(min(count, 255))
+
+        self.size = len(lengths)
+        max_frequency = max(50, int(self.size * KEYWORD_MAX_DOCUMENT_FREQUENCY))
+        # 太常見而不建立索引的詞，替換樣式時也不加入
+        self.frequent = {token for token, entry in postings.items() if len(entry[0]) > max_frequency}
+        postings = {token: entry for token, entry in postings.items() if len(entry[0]) <= max_frequency}
+        if len(postings) > KEYWORD_VOCABULARY_LIMIT:
+            kept = heapq.nlargest(KEYWORD_VOCABULARY_LIMIT, postings, key=lambda token: len(postings[token][0]))
+            postings = {token: postings[token] for token in kept}
+        self.postings = postings
+
+        # BM25 的文件長度正規化項，每個樣式預先算好
+        average = (sum(lengths) / self.size) if self.size and sum(lengths) else 1.0
+        self.average = average
+        self.norms = array('f', (self._norm(length) for length in lengths))
+
+    @staticmethod
+    def _terms(record):
+        """回傳 (文件長度, 詞 -> 詞頻)，詞頻只保留最高的 KEYWORD_TERMS_PER_STYLE 個詞"""
+        counts = {}
+        for token in keyword_tokens(record.prompt):
+            counts[token] = counts.get(token, 0) + 2
+        for token in keyword_tokens(record.negative_prompt):
+            counts[token] = counts.get(token, 0) + 1
+        length = sum(counts.values())
+        if len(counts) > KEYWORD_TERMS_PER_STYLE:
+            counts = dict(heapq.nlargest(KEYWORD_TERMS_PER_STYLE, counts.items(), key=lambda item: item[1]))
+        return length, counts
+
+    def _norm(self, length):
+        return self.K1 * (1 - self.B + self.B * length / self.average)
+
+    def replace(self, slot, old, new):
+        """樣式內容變更時只更新該 slot 的 posting 與長度正規化項（平均長度沿用建立時的值）"""
+        for token in self._terms(old)[1]:
+            entry = self.postings.get(token)
+            if entry is None:
+                continue
+            index = bisect.bisect_left(entry[0], slot)
+            if index < len(entry[0]) and entry[0][index] == slot:
+                del entry[0][index]
+                del entry[1][index]
+                if not entry[0]:
+                    del self.postings[token]
+        length, counts = self._terms(new)
+        for token, count in counts.items():
+            if token in self.frequent:
+                continue
+            entry = self.postings.get(token)
+            if entry is None:
+                entry = self.postings[token] = (array('I'), array('B'))
+            index = bisect.bisect_left(entry[0], slot)
+            entry[0].insert(index, slot)
+            entry[1].insert(index, min(count, 255))
+        self.norms[slot] = self._norm(length)
+
+    def search(self, text, limit=5):
+        """回傳分數最高的 (slot, 分數)，同分時依檔案順序"""
+        scores = {}
+        for token in set(keyword_tokens(text)):
+            entry = self.postings.get(token)
+            if entry is None:
+                continue
+            slots, counts = entry
+            frequency = len(slots)
+            idf = math.log(1 + (self.size - frequency + 0.5) / (frequency + 0.5))
+            norms = self.norms
+            for slot, count in zip(slots, counts):
+                scores[slot] = scores.get(slot, 0.0) + idf * count * (self.K1 + 1) / (count + norms[slot])
+        return heapq.nlargest(limit, scores.items(), key=lambda item: (item[1], -item[0]))
+
+
+class _Wildcard:
+    """模板中的 __name__ 萬用字元"""
+    __slots__ = ("name",)
+
+    def __init__(self, name):
+        self.name = name
+
+
+class _Choice:
+    """
+    模板中的選擇群組 {a|b|c}：options 為各選項已解析的 parts，
+    cumulative 為累積權重（沒有 N:: 權重時為 None），每次選 low 到 high 個並以 separator 連接。
+    """
+    __slots__ = ("options", "cumulative", "low", "high", "separator")
+
+    def __init__(self, options, cumulative, low, high, separator):
+        self.options = options
+        self.cumulative = cumulative
+        self.low = low
+        self.high = high
+        self.separator = separator
+
+
+_PROMPT = object()
+_WILDCARD_TOKEN = re.compile(r"__([\w\-./]+?)__")
+_TEMPLATE_SPECIAL = re.compile(r"[{}|_]")
+_CHOICE_RANGE = re.compile(r"\s*(\d*)\s*(?:(-)\s*(\d*)\s*)?\$\$")
+_CHOICE_SEPARATOR = re.compile(r"([^{}|$]*)\$\$")
+_CHOICE_WEIGHT = re.compile(r"\s*(\d+(?:\.\d+)?)\s*::")
+_MAX_WILDCARD_DEPTH = 8
+
+
+def _parse_sequence(text, pos, placeholder, nested):
+    """解析到字串結尾，或（在群組內時）遇到同層的 | 或 } 為止"""
+    parts = []
+    literal = []
+    length = len(text)
+    while pos < length:
+        match = _TEMPLATE_SPECIAL.search(text, pos)
+        if match is None:
+            literal.append(text[pos:])
+            pos = length
+            break
+        if match.start() > pos:
+            literal.append(text[pos:match.start()])
+            pos = match.start()
+
+        char = text[pos]
+        node = None
+        if char in "|}":
+            if nested:
+                break
+            literal.append(char)
+            pos += 1
+            continue
+        if char == "{":
+            if placeholder and text.startswith("{prompt}", pos):
+                node, end = _PROMPT, pos + len("{prompt}")
+            else:
+                group = _parse_choice(text, pos, placeholder)
+                if group is not None:
+                    node, end = group
+        else:
+            wildcard = _WILDCARD_TOKEN.match(text, pos)
+            if wildcard is not None:
+                node, end = _Wildcard(wildcard.group(1)), wildcard.end()
+
+        if node is None:
+            # 不成立的語法（例如不成對的括號）視為一般文字
+            literal.append(char)
+            pos += 1
+            continue
+        if literal:
+            parts.append("".join(literal))
+            literal = []
+        parts.append(node)
+        pos = end
+
+    if literal:
+        parts.append("".join(literal))
+    return parts, pos
+
+
+def _parse_choice(text, pos, placeholder):
+    """解析從 pos（'{'）開始的選擇群組，回傳 (_Choice, 結束位置)；不成立時回傳 None"""
+    pos += 1
+    low = high = 1
+    separator = ", "
+    ranged = _CHOICE_RANGE.match(text, pos)
+    if ranged is not None:
+        low = int(ranged.group(1)) if ranged.group(1) else 1
+        high = int(ranged.group(3)) if ranged.group(3) else (None if ranged.group(2) else low)
+        pos = ranged.end()
+        custom = _CHOICE_SEPARATOR.match(text, pos)
+        if custom is not None:
+            separator = custom.group(1)
+            pos = custom.end()
+
+    options = []
+    weights = []
+    while True:
+        parts, pos = _parse_sequence(text, pos, placeholder, nested=True)
+        if pos >= len(text):
+            return None
+        weight = 1.0
+        if parts and parts[0].__class__ is str:
+            weighted = _CHOICE_WEIGHT.match(parts[0])
+            if weighted is not None:
+                weight = float(weighted.group(1))
+                parts[0] = parts[0][weighted.end():]
+        options.append(tuple(parts))
+        weights.append(weight)
+        pos += 1
+        if text[pos - 1] == "}":
+            break
+
+    # 只有一個選項且沒有 N$$ 的 {...} 不是選擇群組
+    if len(options) == 1 and ranged is None:
+        return None
+
+    cumulative = None
+    if any(weight != 1.0 for weight in weights):
+        cumulative = tuple(itertools.accumulate(weights))
+    if high is None:
+        high = len(options)
+    return _Choice(tuple(options), cumulative, low, max(low, high), separator), pos
+
+
+def compile_template(text, placeholder=True):
+    """
+    將模板解析為 parts：字串、{prompt}（placeholder 為 True 時）、_Wildcard 或 _Choice（可巢狀）。
+    只在載入樣式庫時解析一次；不含萬用字元或選擇群組的模板回傳 None，套用時直接走一般的字串替換。
+    """
+    if not isinstance(text, str) or not ("__" in text or ("{" in text and ("|" in text or "$$" in text))):
+        return None
+    program, _ = _parse_sequence(text, 0, placeholder, nested=False)
+    if all(part.__class__ is str or part is _PROMPT for part in program):
+        return None
+    return tuple(program)
+
+
+def _pick_options(choice, rng):
+    count = len(choice.options)
+    picks = choice.low if choice.low == choice.high else rng.randint(choice.low, choice.high)
+    picks = min(picks, count)
+    if picks == 1:
+        if choice.cumulative is None:
+            return [rng.randrange(count)]
+        return [min(bisect.bisect_right(choice.cumulative, rng.random() * choice.cumulative[-1]), count - 1)]
+
+    if choice.cumulative is None:
+        return rng.sample(range(count), picks)
+    # 依權重不重複抽樣
+    weights = [b - a for a, b in zip((0.0,) + choice.cumulative, choice.cumulative)]
+    remaining = list(range(count))
+    selected = []
+    for _ in range(picks):
+        target = rng.random() * sum(weights[i] for i in remaining)
+        for position, index in enumerate(remaining):
+            target -= weights[index]
+            if target < 0 or position == len(remaining) - 1:
+                selected.append(remaining.pop(position))
+                break
+    return selected
+
+
+def render_template(program, rng, prompt="", depth=0):
+    """依 rng 展開已解析的模板；找不到的萬用字元保留原文"""
+    output = []
+    for part in program:
+        if part.__class__ is str:
+            output.append(part)
+        elif part is _PROMPT:
+            output.append(prompt)
+        elif part.__class__ is _Choice:
+            indices = _pick_options(part, rng)
+            if len(indices) == 1:
+                output.append(render_template(part.options[indices[0]], rng, prompt, depth))
+            else:
+                rendered = (render_template(part.options[index], rng, prompt, depth).strip() for index in indices)
+                output.append(part.separator.join(text for text in rendered if text))
+        else:
+            line = wildcard_store.pick(part.name, rng)
+            if line is None:
+                output.append(f"__{part.name}__")
+                continue
+            nested = compile_template(line, placeholder=False) if depth < _MAX_WILDCARD_DEPTH else None
+            output.append(render_template(nested, rng, depth=depth + 1) if nested else line)
+    return "".join(output)
+
+
+class WildcardFile:
+    """
+    以行偏移索引存取的萬用字元檔。索引（每個有效行的起始位置）只在檔案變更時建立一次並存到磁碟，
+    之後索引以 mmap 開啟，隨機取一行只讀取該行，不需要讀入或掃描整個檔案。
+    萬用字元檔本身不做 mmap：使用者可能直接覆寫正在使用的檔案，映射被截短的檔案會讓整個行程當掉。
+    """
+    _MAGIC = b"SSXLWC1\0"
+    _HEADER = struct.Struct("<8sQQ")
+
+    def __init__(self, path, index_path, stamp):
+        self.path = path
+        self.index_path = index_path
+        self.stamp = stamp
+        if not self._index_is_current(index_path):
+            self._build_index(index_path)
+
+        self._file = open(path, 'rb')
+        self._read_lock = threading.Lock()
+        self._index_file = open(index_path, 'rb')
+        self._index = mmap.mmap(self._index_file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.count = (len(self._index) - self._HEADER.size) // 8
+
+    def _index_is_current(self, index_path):
+        try:
+            with open(index_path, 'rb') as file:
+                magic, mtime_ns, size = self._HEADER.unpack(file.read(self._HEADER.size))
+            return magic == self._MAGIC and (mtime_ns, size) == self.stamp
+        except (OSError, struct.error):
+            return False
+
+    def _build_index(self, index_path):
+        offsets = array('Q')
+        position = 0
+        with open(self.path, 'rb') as file:
+            for line in file:
+                text = line.strip()
+                # 忽略空行與註解
+                if text and not text.startswith(b"#"):
+                    offsets.append(position)
+                position += len(line)
+        if sys.byteorder != "little":
+            offsets.byteswap()
+
+        os.makedirs(os.path.dirname(index_path), exist_ok=True)
+        # 暫存檔名不與其他行程（共用索引目錄的 webui）衝突
+        temp_path = f"{index_path}.{os.getpid()}.tmp"
+        with open(temp_path, 'wb') as file:
+            file.write(self._HEADER.pack(self._MAGIC, *self.stamp))
+            offsets.tofile(file)
+        os.replace(temp_path, index_path)
+
+    def __len__(self):
+        return self.count
+
+    def line(self, index):
+        (start,) = struct.unpack_from("<Q", self._index, self._HEADER.size + 8 * index)
+        with self._read_lock:
+            self._file.seek(start)
+            line = self._file.readline()
+        return line.decode("utf-8", errors="replace").strip()
+
+    def close(self):
+        self._index.close()
+        self._file.close()
+        self._index_file.close()
+
+
+class WildcardStore:
+    """
+    依名稱找到萬用字元檔（<目錄>/<name>.txt），開啟後快取，檔案變更時重新建立索引。
+    同時生成的工作可能同時要求同一個檔案：開啟與建立索引以每個名稱的鎖保護，只做一次。
+    """
+
+    def __init__(self, directory, cache_directory):
+        self.directory = directory
+        self.cache_directory = cache_directory
+        self._files = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    def _name_lock(self, name):
+        with self._lock:
+            lock = self._locks.get(name)
+            if lock is None:
+                lock = self._locks[name] = threading.Lock()
+            return lock
+
+    def get(self, name):
+        if not name or ".." in name.split("/") or os.path.isabs(name):
+            return None
+        path = os.path.join(self.directory, *name.split("/")) + ".txt"
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        stamp = (stat.st_mtime_ns, stat.st_size)
+
+        wildcard = self._files.get(name)
+        if wildcard is not None and wildcard.stamp == stamp:
+            return wildcard
+
+        with self._name_lock(name):
+            # 等鎖期間其他執行緒可能已經開啟了
+            previous = self._files.get(name)
+            if previous is not None and previous.stamp == stamp:
+                return previous
+            # 索引檔名包含檔案的版本：其他執行緒可能仍在讀取舊版本的 mmap，不能覆寫或關閉它，
+            # 舊的 WildcardFile 不再被引用後才由 GC 關閉
+            index_name = (f"{zlib.crc32(os.path.abspath(path).encode('utf-8')):08x}-{os.path.basename(path)}"
+                          f"-{stamp[0]:x}-{stamp[1]:x}.idx")
+            try:
+                wildcard = WildcardFile(path, os.path.join(self.cache_directory, index_name), stamp)
+            except Exception as e:
+                print(f"Could not open wildcard '{name}': {e}")
+                return None
+            self._files[name] = wildcard
+        if previous is not None:
+            # 舊版本的索引已用不到；Windows 上仍被映射時無法刪除，略過
+            try:
+                os.remove(previous.index_path)
+            except OSError:
+                pass
+        return wildcard
+
+    def pick(self, name, rng):
+        wildcard = self.get(name)
+        if wildcard is None or not len(wildcard):
+            return None
+        return wildcard.line(rng.randrange(len(wildcard)))
+
+
+def get_wildcards_dir():
+    return getattr(shared.opts, "styleselector_wildcards_dir", "") or os.path.join(scripts.basedir(), 'wildcards')
+
+
+wildcard_store = WildcardStore(get_wildcards_dir(), os.path.join(scripts.basedir(), 'wildcard_index'))
+
+
+PACK_FORMAT = "styleselector-pack"
+PACK_VERSION = 2
+_TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+
+
+def stable_style_id(name):
+    """由原始名稱推導的穩定 id（v1 升級時使用）"""
+    return f"s{zlib.crc32(str(name).encode('utf-8')):08x}"
+
+
+def estimate_token_count(text):
+    """粗略估計 CLIP token 數（單字與標點各算一個）"""
+    if not isinstance(text, str):
+        return 0
+    return len(_TOKEN_PATTERN.findall(text.replace('{prompt}', ' ')))
+
+
+def item_categories(item):
+    """樣式的category列表：v2 為陣列，v1 為逗號分隔字串"""
+    categories = item.get('categories')
+    if isinstance(categories, list):
+        return [category.strip() for category in categories if isinstance(category, str) and category.strip()]
+    return _split_categories(item.get('category'))
+
+
+def style_content_hash(item):
+    """樣式內容（不含 id/名稱）的雜湊，供 v2 格式預先計算並在重新上傳時比對"""
+    content = [item.get('prompt'), item.get('negative_prompt', ""), item.get('namezh'), item.get('namejp'),
+               item_categories(item), item.get('weight', 1)]
+    return f"{zlib.crc32(json.dumps(content, ensure_ascii=False).encode('utf-8')):08x}"
+
+
+def pack_items(json_data):
+    """
+    取出樣式檔中的樣式列表：v1 為 JSON 陣列，v2 為 {"format", "version": 2, "styles": [...]}。
+    無法辨識時回傳 None。
+    """
+    if isinstance(json_data, list):
+        return json_data
+    if isinstance(json_data, dict) and isinstance(json_data.get('styles'), list):
+        check_pack_version(json_data.get('version', PACK_VERSION))
+        return json_data['styles']
+    return None
+
+
+def check_pack_version(version):
+    if isinstance(version, int) and version > PACK_VERSION:
+        print(f"Warning: style pack version {version} is newer than supported version {PACK_VERSION}")
+
+
+def upgrade_style_pack(json_data):
+    """
+    將 v1 樣式檔（或 v2）轉成 v2：穩定 id、陣列category、權重，以及預先計算的內容雜湊與 token 數。
+    """
+    styles = list(upgrade_style_items(pack_items(json_data) or [], set()))
+    return {"format": PACK_FORMAT, "version": PACK_VERSION, "styles": styles}
+
+
+def upgrade_style_items(items, used_ids):
+    """逐項轉成 v2 樣式；used_ids 是已使用的 id，重複時加上 -2、-3 等後綴（會加入新的 id）"""
+    for item in items:
+        if not isinstance(item, dict) or 'name' not in item:
+            continue
+        style_id = item.get('id') or stable_style_id(item['name'])
+        base_id, suffix = style_id, 2
+        while style_id in used_ids:
+            style_id = f"{base_id}-{suffix}"
+            suffix += 1
+        used_ids.add(style_id)
+
+        style = {"id": style_id, "name": item['name']}
+        for field in ("namezh", "namejp"):
+            if item.get(field):
+                style[field] = item[field]
+        style["prompt"] = item.get('prompt', "")
+        style["negative_prompt"] = item.get('negative_prompt', "")
+        style["categories"] = item_categories(item)
+        if item.get('weight', 1) != 1:
+            style["weight"] = item['weight']
+        style["hash"] = style_content_hash(item)
+        style["tokens"] = estimate_token_count(style["prompt"])
+        yield style
+
+
+class StyleRecord:
+    """
+    單一樣式的精簡記錄（使用 __slots__，取代每個樣式一個 dict）。
+    很少用到的欄位不佔用每個記錄的空間：一般樣式讀到的是這裡的類別預設值 None，
+    有設定這些欄位的樣式改用 _ExtendedStyleRecord（見 make_style_record）。
+    """
+    __slots__ = ("name", "namezh", "namejp", "prompt", "negative_prompt", "category_ids")
+    # 含萬用字元或選擇群組的模板在載入時預先解析，其餘為 None
+    prompt_program = None
+    negative_program = None
+    # v2 欄位：與名稱推導的 id 相同時記為 None，權重 1 記為 None
+    id = None
+    weight = None
+
+    def __init__(self, name, namezh, namejp, prompt, negative_prompt, category_ids):
+        self.name = name
+        self.namezh = namezh
+        self.namejp = namejp
+        self.prompt = prompt
+        self.negative_prompt = negative_prompt
+        self.category_ids = category_ids
+
+    def display_name(self, language="default"):
+        # 根據語言選擇顯示名稱
+        if language == "chinese" and self.namezh:
+            return self.namezh
+        elif language == "japanese" and self.namejp:
+            return self.namejp
+        return self.name
+
+
+class _ExtendedStyleRecord(StyleRecord):
+    """有模板程式、自訂 id 或權重的樣式"""
+    __slots__ = ("prompt_program", "negative_program", "id", "weight")
+
+
+def make_style_record(name, namezh, namejp, prompt, negative_prompt, category_ids,
+                      prompt_program=None, negative_program=None, style_id=None, weight=None):
+    if prompt_program is None and negative_program is None and style_id is None and weight is None:
+        return StyleRecord(name, namezh, namejp, prompt, negative_prompt, category_ids)
+    record = _ExtendedStyleRecord(name, namezh, namejp, prompt, negative_prompt, category_ids)
+    record.prompt_program = prompt_program
+    record.negative_program = negative_program
+    record.id = style_id
+    record.weight = weight
+    return record
+
+
+class StyleRegistry:
+    """
+    已載入的樣式庫。樣式依檔案順序存放為 StyleRecord；
+    大量重複的 negative_prompt 與 category 字串會共用同一個物件，
+    category 以小整數 id 表示，並預先建立名稱與分類索引。
+    重新上傳修改過的樣式檔時，可用 apply_update 只重建有變更的樣式，
+    樣式與category成員的順序仍與新檔案相同。
+    """
+    _instances = itertools.count(1)
+
+    def __init__(self, json_data=None, source=""):
+        self.source = source
+        self.uid = next(StyleRegistry._instances)
+        self.revision = 0
+        self.records = []
+        self.categories = []
+        self._category_ids = {}
+        self._category_members = []
+        self._member_cache = {}
+        self._by_name = {}
+        self._pool = {}
+        self._aliases = {}
+        self._display_cache = {}
+        self._clusters = {}
+        self._signatures = None
+        self._weights = {}
+        self._weighted = 0
+        self._by_id = None
+        self._keywords = None
+        # 關鍵字索引可在背景建立：樣式變更時 _keyword_generation 加一，建立期間有變更的結果會捨棄重建
+        self._keyword_lock = threading.Lock()
+        self._keyword_generation = 0
+        self._keyword_thread = None
+        self._bitsets = {}
+        self._expressions = {}
+        if json_data:
+            self.extend(pack_items(json_data) or [])
+
+    def __len__(self):
+        return len(self.records)
+
+    def _shared(self, value):
+        """重複內容共用同一個物件（只用於大量重複的欄位）"""
+        if value is None:
+            return None
+        return self._pool.setdefault(value, value)
+
+    def _category_id(self, category):
+        category_id = self._category_ids.get(category)
+        if category_id is None:
+            category_id = len(self.categories)
+            self._category_ids[category] = category_id
+            self.categories.append(category)
+            # 依檔案順序的 slot 列表
+            self._category_members.append(array('I'))
+        return category_id
+
+    def _make_record(self, item):
+        category_ids = self._shared(tuple(self._category_id(self._shared(cat)) for cat in item_categories(item)))
+        negative_prompt = item.get('negative_prompt', "")
+        weight = item.get('weight')
+        if not isinstance(weight, (int, float)) or weight == 1 or weight < 0:
+            weight = None
+        style_id = item.get('id')
+        if style_id == stable_style_id(item['name']):
+            style_id = None
+        return make_style_record(
+            item['name'],
+            item.get('namezh'),
+            item.get('namejp'),
+            item.get('prompt'),
+            self._shared(negative_prompt) if isinstance(negative_prompt, str) else negative_prompt,
+            category_ids,
+            compile_template(item.get('prompt')),
+            compile_template(negative_prompt, placeholder=False),
+            style_id,
+            weight,
+        )
+
+    def _matches(self, record, item, category_memo):
+        """
+        樣式內容是否與記錄相同（重新上傳時用來判斷變更），name 相同的前提下比對其餘欄位。
+        一律比對實際欄位；檔案中的 hash 可能是手動修改內容後未更新的舊值，不能取代比對。
+        category_memo 快取 category 欄位原始值 -> category id，整個樣式檔只需拆解每種寫法一次。
+        """
+        item_id = item.get('id')
+        return (
+            record.prompt == item.get('prompt')
+            and record.negative_prompt == item.get('negative_prompt', "")
+            and record.namezh == item.get('namezh')
+            and record.namejp == item.get('namejp')
+            and record.weight == (item.get('weight') if item.get('weight', 1) != 1 else None)
+            and (record.id is None if not item_id else item_id == (record.id or stable_style_id(record.name)))
+            and self._item_category_ids(item, category_memo) == record.category_ids
+        )
+
+    def _item_category_ids(self, item, memo):
+        categories = item.get('categories')
+        key = tuple(categories) if isinstance(categories, list) else (None, item.get('category'))
+        try:
+            return memo[key]
+        except KeyError:
+            pass
+        except TypeError:
+            key = None
+        # 尚未出現過的 category 記為 -1，必定與記錄不同
+        ids = tuple(self._category_ids.get(category, -1) for category in item_categories(item))
+        if key is not None:
+            memo[key] = ids
+        return ids
+
+    def _add_member(self, category_id, slot):
+        members = self._category_members[category_id]
+        # slot 依序加入；同一個樣式重複列出同一個category時只記一次
+        if not members or members[-1] != slot:
+            members.append(slot)
+
+    def _index(self, slot, record):
+        for category_id in record.category_ids:
+            self._add_member(category_id, slot)
+            self._member_cache.pop(category_id, None)
+        self._index_display(record)
+
+    def _index_display(self, record):
+        if record.weight is not None:
+            self._weighted += 1
+        for language, names in self._display_cache.items():
+            bisect.insort(names, record.display_name(language), 1)
+
+    def _unindex_display(self, record):
+        if record.weight is not None:
+            self._weighted -= 1
+        for language, names in self._display_cache.items():
+            display_name = record.display_name(language)
+            index = bisect.bisect_left(names, display_name, 1)
+            if index < len(names) and names[index] == display_name:
+                del names[index]
+
+    def _append(self, item):
+        slot = len(self.records)
+        record = self._make_record(item)
+        self.records.append(record)
+        self._index(slot, record)
+        # 名稱重複時以第一個為準（與逐項搜尋的結果一致）
+        self._by_name.setdefault(record.name, slot)
+        return record
+
+    def extend(self, json_data):
+        for item in json_data:
+            if isinstance(item, dict) and 'name' in item:
+                self._append(item)
+        self._changed()
+
+    def add(self, item):
+        record = self._append(item)
+        self._changed()
+        return record
+
+    def _changed(self):
+        self.revision += 1
+        self._aliases.clear()
+        self._clusters.clear()
+        self._signatures = None
+        self._weights.clear()
+        self._by_id = None
+        with self._keyword_lock:
+            self._keywords = None
+            self._keyword_generation += 1
+        self._bitsets.clear()
+        self._expressions.clear()
+
+    def apply_update(self, json_data):
+        """
+        與新的樣式檔比對（依 name 與各欄位內容），只重新建立新增與變更的樣式，其餘沿用原本的記錄，
+        並依新檔案的順序排列。回傳 (新增數, 刪除數, 變更數)；任一方有重複名稱時無法比對，回傳 None。
+        名稱與順序都沒變時（一般的修改後重新上傳）只在原 slot 替換變更的樣式並修補相關索引，
+        有新增、刪除或調換順序時才重新編號並捨棄衍生的索引。
+        """
+        if isinstance(json_data, (list, dict)):
+            json_data = pack_items(json_data)
+            if json_data is None:
+                return None
+        new_items = {}
+        for item in json_data:
+            if isinstance(item, dict) and 'name' in item:
+                if item['name'] in new_items:
+                    return None
+                new_items[item['name']] = item
+        if len(self._by_name) != len(self.records):
+            return None
+        if len(new_items) == len(self.records) and all(
+                record.name == name for record, name in zip(self.records, new_items)):
+            return self._update_in_place(new_items.values())
+
+        # 依新檔案的順序排列；內容沒變的樣式沿用原本的記錄物件，只有新增與變更的樣式重新建立
+        category_memo = {}
+        records = []
+        replaced = []
+        created = []
+        for name, item in new_items.items():
+            slot = self._by_name.get(name)
+            record = None if slot is None else self.records[slot]
+            if record is not None and not self._matches(record, item, category_memo):
+                replaced.append(record)
+                record = None
+            if record is None:
+                record = self._make_record(item)
+                created.append(record)
+            records.append(record)
+        removed = [self.records[slot] for name, slot in self._by_name.items() if name not in new_items]
+
+        if not (created or removed) and all(old is new for old, new in zip(self.records, records)):
+            return 0, 0, 0
+
+        # 排序名單與權重計數只更新有變動的樣式
+        for record in removed + replaced:
+            self._unindex_display(record)
+        for record in created:
+            self._index_display(record)
+
+        # slot 依新順序重新編號：名稱索引與category成員只是整數對應，直接重建
+        self.records = records
+        self._by_name = {record.name: slot for slot, record in enumerate(records)}
+        for members in self._category_members:
+            del members[:]
+        for slot, record in enumerate(records):
+            for category_id in record.category_ids:
+                self._add_member(category_id, slot)
+        self._member_cache.clear()
+
+        self._changed()
+        return len(created) - len(replaced), len(removed), len(replaced)
+
+    def _update_in_place(self, items):
+        changed = []
+        category_memo = {}
+        for slot, (record, item) in enumerate(zip(self.records, items)):
+            if not self._matches(record, item, category_memo):
+                changed.append((slot, record, self._make_record(item)))
+        for slot, old, new in changed:
+            self._replace(slot, old, new)
+        if changed:
+            self.revision += 1
+        return 0, 0, len(changed)
+
+    def _replace(self, slot, old, new):
+        """把 slot 上的記錄換成 new，只修補與這個樣式有關的索引與快取"""
+        self.records[slot] = new
+        self._unindex_display(old)
+        self._index_display(new)
+
+        old_ids, new_ids = set(old.category_ids), set(new.category_ids)
+        for category_id in old_ids - new_ids:
+            members = self._category_members[category_id]
+            del members[bisect.bisect_left(members, slot)]
+        for category_id in new_ids - old_ids:
+            members = self._category_members[category_id]
+            members.insert(bisect.bisect_left(members, slot), slot)
+        for category_id in old_ids | new_ids:
+            self._member_cache.pop(category_id, None)
+        if old_ids != new_ids:
+            for category_id in old_ids ^ new_ids:
+                self._bitsets.pop(category_id, None)
+            self._expressions.clear()
+        else:
+            # 成員不變，運算式結果中的記錄換成新物件即可
+            for members in self._expressions.values():
+                try:
+                    members[members.index(old)] = new
+                except ValueError:
+                    pass
+
+        # 分群與權重只捨棄包含這個樣式的category（運算式的結果無法判斷，一併捨棄）
+        affected = {self.categories[category_id] for category_id in old_ids | new_ids} | {"ALL"}
+        for cache in (self._clusters, self._weights):
+            for category in [key for key in cache if key in affected or key not in self._category_ids]:
+                del cache[category]
+        if self._signatures is not None and old.prompt != new.prompt:
+            start = slot * _SIGNATURE_BINS
+            self._signatures[start:start + _SIGNATURE_BINS] = array('H', style_signature(new.prompt))
+
+        if self._by_id is not None:
+            old_id = old.id or stable_style_id(old.name)
+            new_id = new.id or stable_style_id(new.name)
+            if old_id != new_id:
+                if self._by_id.get(old_id) == slot:
+                    del self._by_id[old_id]
+                    # 其他樣式也可能使用同一個 id
+                    for other, record in enumerate(self.records):
+                        if (record.id or stable_style_id(record.name)) == old_id:
+                            self._by_id[old_id] = other
+                            break
+                if self._by_id.get(new_id, slot + 1) > slot:
+                    self._by_id[new_id] = slot
+
+        for language, field in (("chinese", "namezh"), ("japanese", "namejp")):
+            aliases = self._aliases.get(language)
+            if aliases is not None and getattr(old, field) != getattr(new, field):
+                for text in (getattr(old, field), getattr(new, field)):
+                    self._refresh_alias(aliases, field, text)
+
+        if old.prompt != new.prompt or old.negative_prompt != new.negative_prompt:
+            with self._keyword_lock:
+                self._keyword_generation += 1
+                if self._keywords is not None:
+                    self._keywords.replace(slot, old, new)
+
+    def _refresh_alias(self, aliases, field, text):
+        """重新決定顯示名稱 text 的對應（規則與 _alias_map 相同：依檔案順序以第一個符合的樣式為準）"""
+        aliases.pop(text, None)
+        for record in self.records:
+            if getattr(record, field) == text:
+                if text != record.name:
+                    aliases[text] = record.name
+                return
+            if record.name == text:
+                return
+
+    def etag(self, *parts):
+        """內容版本標記（供 API 的 ETag 使用）"""
+        return 'W/"' + "-".join(str(part) for part in (self.uid, self.revision) + parts) + '"'
+
+    def _alias_map(self, language):
+        """
+        顯示名稱 -> 原始名稱，只記錄與原始名稱不同的項目（其餘查詢直接回傳原值）。
+        依檔案順序以第一個符合（翻譯名稱或原始名稱）的樣式為準，第一次使用該語言時才建立。
+        """
+        aliases = self._aliases.get(language)
+        if aliases is None:
+            field = {"chinese": "namezh", "japanese": "namejp"}[language]
+            aliases = {}
+            claimed = set()
+            for record in self.records:
+                localized = getattr(record, field)
+                if localized not in claimed and localized != record.name:
+                    aliases[localized] = record.name
+                claimed.add(localized)
+                claimed.add(record.name)
+            self._aliases[language] = aliases
+        return aliases
+
+    def original_name(self, display_name, language="default"):
+        """根據顯示名稱找到原始名稱"""
+        if language not in ("chinese", "japanese"):
+            return display_name
+        return self._alias_map(language).get(display_name, display_name)
+
+    def get(self, name):
+        slot = self._by_name.get(name)
+        return None if slot is None else self.records[slot]
+
+    def warm_up(self):
+        """
+        預先建立各語言的排序名單、別名表、category索引與 id 索引（生成時會用到的索引）。
+        只有推薦樣式用到的關鍵字索引不在這裡建立，見 start_keyword_index。
+        """
+        for language in ("default", "chinese", "japanese"):
+            self.display_names(language)
+            self.original_name("", language)
+        for category in self.category_choices():
+            self.members(category)
+        self.get_by_id("")
+
+    def get_by_id(self, style_id):
+        """依穩定 id 找樣式（v1 樣式使用由名稱推導的 id），索引第一次使用時才建立"""
+        if self._by_id is None:
+            by_id = {}
+            for slot, record in enumerate(self.records):
+                by_id.setdefault(record.id or stable_style_id(record.name), slot)
+            self._by_id = by_id
+        slot = self._by_id.get(style_id)
+        return None if slot is None else self.records[slot]
+
+    def keyword_index(self):
+        """樣式模板的關鍵字索引；背景建立中時等它完成，尚未建立時直接建立，樣式庫變更後重建"""
+        thread = self._keyword_thread
+        if thread is not None and thread is not threading.current_thread():
+            thread.join()
+        keywords = self._keywords
+        if keywords is None:
+            keywords = self._build_keyword_index()
+        return keywords
+
+    def _build_keyword_index(self):
+        while True:
+            with self._keyword_lock:
+                generation = self._keyword_generation
+                records = list(self.records)
+            keywords = KeywordIndex(records)
+            with self._keyword_lock:
+                if generation == self._keyword_generation:
+                    self._keywords = keywords
+                    return keywords
+
+    def start_keyword_index(self):
+        """在背景執行緒建立關鍵字索引（已建立或正在建立時不重複），生成不必等它"""
+        with self._keyword_lock:
+            thread = self._keyword_thread
+            if self._keywords is not None or (thread is not None and thread.is_alive()):
+                return
+            self._keyword_thread = threading.Thread(
+                target=self._build_keyword_index, name="StyleSelectorXL keyword index", daemon=True)
+            self._keyword_thread.start()
+
+    def suggest(self, text, limit=5):
+        """依提示詞文字推薦最相符的樣式"""
+        keywords = self.keyword_index()
+        return [self.records[slot] for slot, _ in keywords.search(text, limit)]
+
+    def lookup(self, display_name, language="default"):
+        """依顯示名稱找樣式，找不到時再當作穩定 id 查詢"""
+        record = self.get(self.original_name(display_name, language))
+        if record is None and isinstance(display_name, str):
+            record = self.get_by_id(display_name)
+        return record
+
+    def pick(self, category, rng=random):
+        """從category中隨機選一個樣式；有樣式設定權重時依權重抽選"""
+        members = self.members(category)
+        if not members:
+            return None
+        if not self._weighted:
+            return rng.choice(members)
+        cumulative = self._weights.get(category)
+        if cumulative is None:
+            cumulative = list(itertools.accumulate(1.0 if record.weight is None else record.weight for record in members))
+            self._weights[category] = cumulative
+        if not cumulative[-1]:
+            return rng.choice(members)
+        return members[min(bisect.bisect_right(cumulative, rng.random() * cumulative[-1]), len(members) - 1)]
+
+    def display_names(self, language="default"):
+        """排序後的顯示名稱（含 "Random Select"），依語言快取，更新時以二分插入維持排序"""
+        names = self._display_cache.get(language)
+        if names is None:
+            names = sorted(record.display_name(language) for record in self.records)
+            # 在名單前面加入 "Random Select" 選項
+            names.insert(0, "Random Select")
+            self._display_cache[language] = names
+        return list(names)
+
+    def category_choices(self):
+        return sorted({category for category, members in zip(self.categories, self._category_members) if members} | {"ALL"})
+
+    def members(self, category):
+        """
+        回傳屬於該category的樣式（載入時依檔案順序）。
+        category 也可以是布林運算式（見 compile_category_expression），結果依運算式快取。
+        """
+        if category == "ALL":
+            return self.records
+        category_id = self._category_ids.get(category)
+        if category_id is None:
+            return self._expression_members(category)
+        members = self._member_cache.get(category_id)
+        if members is None:
+            members = [self.records[slot] for slot in self._category_members[category_id]]
+            self._member_cache[category_id] = members
+        return members
+
+    def _category_bits(self, category):
+        """category的成員位元集合（第 slot 個位元代表第 slot 個樣式），第一次用到時才建立"""
+        if category == "ALL":
+            return (1 << len(self.records)) - 1
+        category_id = self._category_ids.get(category)
+        if category_id is None:
+            return 0
+        bits = self._bitsets.get(category_id)
+        if bits is None:
+            flags = bytearray((len(self.records) + 7) // 8)
+            for slot in self._category_members[category_id]:
+                flags[slot >> 3] |= 1 << (slot & 7)
+            bits = self._bitsets[category_id] = int.from_bytes(flags, "little")
+        return bits
+
+    def _evaluate_category(self, node):
+        kind = node[0]
+        if kind == "category":
+            return self._category_bits(node[1])
+        if kind == "not":
+            return self._category_bits("ALL") & ~self._evaluate_category(node[1])
+        values = [self._evaluate_category(child) for child in node[1]]
+        bits = values[0]
+        for value in values[1:]:
+            bits = bits & value if kind == "and" else bits | value
+        return bits
+
+    def _expression_members(self, expression):
+        members = self._expressions.get(expression)
+        if members is not None:
+            return members
+        try:
+            program = compile_category_expression(expression)
+        except ValueError as e:
+            print(f"Invalid Random Category: {e}")
+            program = None
+
+        members = []
+        if program is not None:
+            flags = self._evaluate_category(program).to_bytes((len(self.records) + 7) // 8, "little")
+            for index, byte in enumerate(flags):
+                if byte:
+                    members.extend(self.records[(index << 3) + bit] for bit in range(8) if byte >> bit & 1)
+        if len(self._expressions) >= CATEGORY_EXPRESSION_CACHE_SIZE:
+            self._expressions.clear()
+        self._expressions[expression] = members
+        return members
+
+    def signature_column(self):
+        """
+        所有樣式的 MinHash 簽章（依 slot 排列，每個樣式 _SIGNATURE_BINS 個 16 位元值），
+        只有 Diverse 模式分群時才需要，第一次使用時計算，樣式庫變更後重建。
+        """
+        column = self._signatures
+        if column is None:
+            column = array('H')
+            for record in self.records:
+                column.frombytes(style_signature(record.prompt))
+            self._signatures = column
+        return column
+
+    def clusters(self, category):
+        """
+        將category內的樣式依簽章分群：共用任一 band key、且相同的 bin 數達到 _SIGNATURE_MIN_EQUAL_BINS
+        的樣式併入同一群（union-find），結果依category快取，樣式庫變更時才重建。
+        """
+        clusters = self._clusters.get(category)
+        if clusters is None:
+            members = self.members(category)
+            column = self.signature_column()
+            if members is self.records:
+                slots = range(len(members))
+            else:
+                slot_of = {id(record): slot for slot, record in enumerate(self.records)}
+                slots = [slot_of[id(record)] for record in members]
+            parent = list(range(len(members)))
+
+            def find(index):
+                while parent[index] != index:
+                    parent[index] = parent[parent[index]]
+                    index = parent[index]
+                return index
+
+            # 一次只保留一個 band 的桶；已在同一群的候選不必再比對簽章
+            for start in range(0, _SIGNATURE_BINS, _SIGNATURE_BAND_ROWS):
+                buckets = {}
+                for index, slot in enumerate(slots):
+                    offset = slot * _SIGNATURE_BINS
+                    key = tuple(column[offset + start:offset + start + _SIGNATURE_BAND_ROWS])
+                    if not any(key):
+                        continue
+                    bucket = buckets.get(key)
+                    if bucket is None:
+                        buckets[key] = [index]
+                        continue
+                    signature = column[offset:offset + _SIGNATURE_BINS]
+                    for other in bucket:
+                        root, other_root = find(index), find(other)
+                        if root == other_root:
+                            break
+                        other_offset = slots[other] * _SIGNATURE_BINS
+                        equal = sum(map(operator.eq, signature, column[other_offset:other_offset + _SIGNATURE_BINS]))
+                        if equal >= _SIGNATURE_MIN_EQUAL_BINS:
+                            parent[root] = other_root
+                            break
+                    if len(bucket) < _SIGNATURE_BUCKET_PROBES:
+                        bucket.append(index)
+
+            groups = {}
+            for index, record in enumerate(members):
+                groups.setdefault(find(index), []).append(record)
+            clusters = list(groups.values())
+            self._clusters[category] = clusters
+        return clusters
+
+    def diverse_sample(self, category, count, rng=random):
+        """
+        為一整批圖片挑選 count 個樣式，盡量分散到不同的群：
+        每一輪從尚未抽過的群中不重複抽樣，每群取一個樣式，群數不足時才進入下一輪。
+        分群建好後每次抽樣只與 count 有關，不需掃描整個樣式庫。
+        """
+        clusters = self.clusters(category)
+        picks = []
+        if not clusters:
+            return picks
+        while len(picks) < count:
+            take = min(count - len(picks), len(clusters))
+            for cluster_index in rng.sample(range(len(clusters)), take):
+                picks.append(rng.choice(clusters[cluster_index]))
+        return picks
+
+
+_registry_cache = {}
+
+
+def get_registry(file_path):
+    """載入樣式檔並快取，檔案修改後才重新解析"""
+    if not file_path:
+        return None
+    try:
+        stat = os.stat(file_path)
+        stamp = (stat.st_mtime_ns, stat.st_size)
+    except OSError:
+        stamp = None
+
+    cached = _registry_cache.get(file_path)
+    if cached is not None and stamp is not None and cached[0] == stamp:
+        return cached[1]
+
+    registry = StyleRegistry(source=file_path)
+    try:
+        registry.extend(read_style_pack(file_path))
+    except Exception as e:
+        print(f"A Problem occurred: {str(e)}")
+        registry = None
+    if stamp is not None:
+        _registry_cache[file_path] = (stamp, registry)
+    return registry
+
+
+def update_registry_from_file(file_path, previous=None):
+    """
+    載入新的樣式檔；若有目前的樣式庫，只套用差異並沿用原本的索引。
+    回傳 (registry, 差異摘要)。
+    """
+    wait_for_warmup()
+    try:
+        stat = os.stat(file_path)
+        stamp = (stat.st_mtime_ns, stat.st_size)
+        diff = previous.apply_update(read_style_pack(file_path)) if previous is not None else None
+        if diff is None:
+            registry = StyleRegistry(source=file_path)
+            registry.extend(read_style_pack(file_path))
+    except Exception as e:
+        print(f"A Problem occurred: {str(e)}")
+        return None, None
+
+    if diff is None:
+        summary = f"{len(registry)} styles"
+    else:
+        registry = previous
+        _registry_cache.pop(registry.source, None)
+        registry.source = file_path
+        summary = "+{} added, -{} removed, ~{} changed".format(*diff)
+
+    _registry_cache[file_path] = (stamp, registry)
+    # 變更後的關鍵字索引在背景重建（就地更新時已直接修補）
+    registry.start_keyword_index()
+    return registry, summary
+
+
+_warmup_thread = None
+
+
+def warm_up_registry(file_path):
+    registry = get_registry(file_path)
+    if registry is not None:
+        registry.warm_up()
+        registry.start_keyword_index()
+
+
+def start_registry_warmup(demo=None, app=None):
+    """
+    app 啟動時在背景執行緒建立樣式庫與生成用的索引，避免第一次生成時才付出這些成本；
+    之後關鍵字索引再由另一個背景執行緒建立，生成不會等它。
+    """
+    global _warmup_thread
+    if _warmup_thread is not None:
+        return
+    _warmup_thread = threading.Thread(target=warm_up_registry, args=(stylespath,), name="StyleSelectorXL warm-up", daemon=True)
+    _warmup_thread.start()
+
+
+def wait_for_warmup():
+    """背景預熱尚未完成時等待它結束（已完成則立即返回）"""
+    thread = _warmup_thread
+    if thread is not None and thread.is_alive():
+        thread.join()
+
+
+def invalidate_registry(file_path):
+    _registry_cache.pop(file_path, None)
+
+
+def _as_registry(json_data):
+    if json_data is None or isinstance(json_data, StyleRegistry):
+        return json_data
+    return StyleRegistry(json_data)
+
+
 def read_sdxl_styles(json_data, language="default"):
-    if not isinstance(json_data, list):
+    if isinstance(json_data, StyleRegistry):
+        return json_data.display_names(language)
+    if pack_items(json_data) is None:
         print("Error: input data must be a list")
         return None
-    
-    names = []
-    for item in json_data:
-        if isinstance(item, dict) and 'name' in item:
-            # 根據語言選擇顯示名稱
-            if language == "chinese" and item.get('namezh'):
-                display_name = item['namezh']
-            elif language == "japanese" and item.get('namejp'):
-                display_name = item['namejp']
-            else:
-                display_name = item['name']
-            names.append(display_name)
-    
-    names.sort()
-    # 在名單前面加入 "Random Select" 選項
-    names.insert(0, "Random Select")
-    return names
+    return StyleRegistry(json_data).display_names(language)
 
 
 def get_categories(json_data):
     """從JSON數據中提取所有category值"""
-    categories = set()
-    categories.add("ALL")  # 預設選項
-    
-    for item in json_data:
-        if isinstance(item, dict) and 'category' in item:
-            category_str = item['category']
-            if category_str:
-                # 支援多值（逗號分隔）
-                cats = [cat.strip() for cat in category_str.split(',') if cat.strip()]
-                categories.update(cats)
-    
-    return sorted(list(categories))
+    return _as_registry(json_data).category_choices()
 
 
 def getStyles():
     global stylespath
     json_path = os.path.join(scripts.basedir(), 'nsfw_styles.json')
     stylespath = json_path
-    json_data = get_json_content(json_path)
-    return read_sdxl_styles(json_data)
+    return read_sdxl_styles(get_registry(json_path))
 
 
 def get_original_name_from_display(display_name, json_data, language="default"):
     """根據顯示名稱找到原始名稱"""
-    for item in json_data:
-        if isinstance(item, dict) and 'name' in item:
-            if language == "chinese" and item.get('namezh') == display_name:
-                return item['name']
-            elif language == "japanese" and item.get('namejp') == display_name:
-                return item['name']
-            elif item['name'] == display_name:
-                return item['name']
-    return display_name
+    return _as_registry(json_data).original_name(display_name, language)
 
 
-def createPositive(style, positive):
-    json_data = get_json_content(stylespath)
+def style_positive(registry, style, positive, language="default", rng=None):
     try:
-        if not isinstance(json_data, list):
+        if registry is None:
             raise ValueError("Invalid JSON data. Expected a list of templates.")
 
         # 如果選擇了 "Random Select"，隨機選擇一個樣式
         if style == "Random Select":
-            available_styles = [item['name'] for item in json_data if isinstance(item, dict) and 'name' in item]
-            if available_styles:
-                style = random.choice(available_styles)
+            if registry.records:
+                style = registry.pick("ALL").name
             else:
                 return positive  # 如果沒有可用樣式，返回原始提示
 
         # 根據顯示名稱找到原始名稱
-        original_name = get_original_name_from_display(style, json_data, current_language)
-        
-        for template in json_data:
-            if template.get('name') == original_name:
-                return template['prompt'].replace('{prompt}', positive)
+        template = registry.lookup(style, language)
+        if template is not None:
+            if rng is not None and template.prompt_program:
+                return render_template(template.prompt_program, rng, positive)
+            return template.prompt.replace('{prompt}', positive)
 
         raise ValueError(f"No template found with name '{style}'.")
     except Exception as e:
         print(f"An error occurred: {str(e)}")
 
 
-def createNegative(style, negative):
-    json_data = get_json_content(stylespath)
+def style_negative(registry, style, negative, language="default", rng=None):
     try:
-        if not isinstance(json_data, list):
+        if registry is None:
             raise ValueError("Invalid JSON data. Expected a list of templates.")
 
         # 如果選擇了 "Random Select"，隨機選擇一個樣式
         if style == "Random Select":
-            available_styles = [item['name'] for item in json_data if isinstance(item, dict) and 'name' in item]
-            if available_styles:
-                style = random.choice(available_styles)
+            if registry.records:
+                style = registry.pick("ALL").name
             else:
                 return negative  # 如果沒有可用樣式，返回原始提示
 
         # 根據顯示名稱找到原始名稱
-        original_name = get_original_name_from_display(style, json_data, current_language)
-        
-        for template in json_data:
-            if template.get('name') == original_name:
-                json_negative_prompt = template.get('negative_prompt', "")
-                return f"{json_negative_prompt}, {negative}" if json_negative_prompt and negative else json_negative_prompt or negative
+        template = registry.lookup(style, language)
+        if template is not None:
+            json_negative_prompt = template.negative_prompt
+            if rng is not None and template.negative_program:
+                json_negative_prompt = render_template(template.negative_program, rng)
+            return f"{json_negative_prompt}, {negative}" if json_negative_prompt and negative else json_negative_prompt or negative
 
         raise ValueError(f"No template found with name '{style}'.")
     except Exception as e:
         print(f"An error occurred: {str(e)}")
 
 
+def createPositive(style, positive):
+    return style_positive(get_registry(stylespath), style, positive, current_language)
+
+
+def createNegative(style, negative):
+    return style_negative(get_registry(stylespath), style, negative, current_language)
+
+
 def get_random_style_by_category(category, json_data, language="default"):
     """根據category隨機選擇樣式"""
-    available_styles = []
-    
-    for item in json_data:
-        if isinstance(item, dict) and 'name' in item:
-            if category == "ALL":
-                # 從所有樣式中選擇
-                available_styles.append(item)
-            else:
-                # 從特定category中選擇
-                item_categories = []
-                if 'category' in item and item['category']:
-                    item_categories = [cat.strip() for cat in item['category'].split(',') if cat.strip()]
-                
-                if category in item_categories:
-                    available_styles.append(item)
-    
-    if available_styles:
-        selected_item = random.choice(available_styles)
+    registry = _as_registry(json_data)
+    if registry is None:
+        return None
+
+    selected_item = registry.pick(category)
+    if selected_item is not None:
         # 根據語言返回對應的顯示名稱
-        if language == "chinese" and selected_item.get('namezh'):
-            return selected_item['namezh']
-        elif language == "japanese" and selected_item.get('namejp'):
-            return selected_item['namejp']
-        else:
-            return selected_item['name']
-    
+        return selected_item.display_name(language)
+
     return None
-        
+
+
+def resolve_selected_styles(styles, random_category, registry, language=None, pick=None):
+    """將 Style 1-4 的選擇解析為實際樣式（處理 Random Select，pick 可替換隨機選擇方式）"""
+    if language is None:
+        language = current_language
+    selected = []
+    for style in styles:
+        if style and style != 'base':
+            if style == "Random Select":
+                # 根據Random Category進行隨機選擇
+                if pick is not None:
+                    random_style = pick(random_category)
+                else:
+                    random_style = get_random_style_by_category(random_category, registry, language)
+                if random_style:
+                    selected.append(random_style)
+            else:
+                selected.append(style)
+    return tuple(selected)
+
+
+RANDOM_MODES = ["Uniform", "Diverse", "Rotation"]
+
+
+def _rotation_index(position, size, seed):
+    """
+    以 4 輪 Feistel 網路加上 cycle-walking，把 position 對應到 [0, size) 的一個隨機排列，
+    每次查詢只需常數時間，不需要存下整個排列或抽樣歷史。
+    """
+    bits = max(2, (size - 1).bit_length())
+    bits += bits % 2
+    half = bits // 2
+    mask = (1 << half) - 1
+    value = position
+    while True:
+        left, right = value >> half, value & mask
+        for round_index in range(4):
+            left, right = right, left ^ (zlib.crc32(f"{seed}:{round_index}:{right}".encode()) & mask)
+        value = (left << half) | right
+        if value < size:
+            return value
+
+
+class StyleRotation:
+    """
+    不重複輪替的 Random Select：每個category走訪一個由 seed 決定的打亂排列，
+    只把 (seed, cursor) 存到磁碟，跨工作與重新啟動都能保證每個樣式輪到一次後才會重複。
+    多個請求可能同時呼叫 next/save，狀態的讀寫都在同一個鎖內進行。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.state = None
+        self.dirty = False
+        self.lock = threading.Lock()
+        # (registry uid, revision, category) -> 成員名稱與順序的雜湊
+        self._digests = {}
+
+    def _load(self):
+        if self.state is None:
+            self.state = {}
+            if os.path.exists(self.path):
+                try:
+                    with open(self.path, 'rt', encoding="utf-8") as file:
+                        self.state = json.load(file)
+                except Exception as e:
+                    print(f"Could not read rotation state: {e}")
+        return self.state
+
+    def _members_digest(self, registry, category, members):
+        """成員名稱與順序的雜湊，依樣式庫版本快取（重新啟動後也能判斷成員是否改變）"""
+        cache_key = (registry.uid, registry.revision, category)
+        digest = self._digests.get(cache_key)
+        if digest is None:
+            digest = 0
+            for record in members:
+                digest = zlib.crc32(record.name.encode("utf-8") + b"\0", digest)
+            if len(self._digests) >= 64:
+                self._digests.clear()
+            self._digests[cache_key] = digest
+        return digest
+
+    def next(self, registry, category):
+        """回傳該category輪替順序中的下一個樣式"""
+        members = registry.members(category)
+        if not members:
+            return None
+        key = f"{os.path.basename(registry.source)}::{category}"
+        with self.lock:
+            digest = self._members_digest(registry, category, members)
+            state = self._load()
+            entry = state.get(key)
+            # 成員或順序改變（排列的位置會對應到不同樣式）或整輪走完時換一個新的排列
+            if (not entry or entry.get("size") != len(members) or entry.get("members") != digest
+                    or entry.get("cursor", 0) >= len(members)):
+                entry = {"seed": random.getrandbits(32), "cursor": 0, "size": len(members), "members": digest}
+                state[key] = entry
+            record = members[_rotation_index(entry["cursor"], len(members), entry["seed"])]
+            entry["cursor"] += 1
+            self.dirty = True
+        return record
+
+    def save(self):
+        with self.lock:
+            if not self.dirty or self.state is None:
+                return
+            try:
+                temp_path = f"{self.path}.tmp"
+                with open(temp_path, 'wt', encoding="utf-8") as file:
+                    json.dump(self.state, file)
+                os.replace(temp_path, self.path)
+                self.dirty = False
+            except Exception as e:
+                print(f"Could not save rotation state: {e}")
+
+
+style_rotation = StyleRotation(os.path.join(scripts.basedir(), 'style_rotation.json'))
+
+
+def resolve_style_assignments(styles, random_category, registry, count, random_per_image=False, random_mode="Uniform", language=None):
+    """
+    為 count 張圖產生各自的樣式組合。
+    未啟用每張圖隨機時整批共用同一組；Diverse 模式下 Random Select 會為整批挑選分散在不同群的樣式，
+    Rotation 模式下依持久化的輪替順序挑選（不論是否每張圖隨機）。
+    """
+    if language is None:
+        language = current_language
+
+    pick = None
+    if random_mode == "Rotation" and registry is not None:
+        def pick(category):
+            record = style_rotation.next(registry, category)
+            return record.display_name(language) if record else None
+
+    if not random_per_image:
+        return [resolve_selected_styles(styles, random_category, registry, language, pick)] * count
+    if random_mode != "Diverse" or registry is None:
+        return [resolve_selected_styles(styles, random_category, registry, language, pick) for _ in range(count)]
+
+    columns = []
+    for style in styles:
+        if style and style != 'base':
+            if style == "Random Select":
+                picks = registry.diverse_sample(random_category, count)
+                if picks:
+                    columns.append([record.display_name(language) for record in picks])
+            else:
+                columns.append([style] * count)
+    return [tuple(column[i] for column in columns) for i in range(count)]
+
+
+def styles_need_expansion(registry, styles, language=None):
+    """這組樣式中是否有需要逐張展開（含萬用字元或選擇群組）的模板"""
+    if registry is None:
+        return False
+    if language is None:
+        language = current_language
+    for style in styles:
+        record = registry.lookup(style, language)
+        if record is not None and (record.prompt_program or record.negative_program):
+            return True
+    return False
+
+
+def build_injections(registry, assignments, language, seeds=None):
+    """
+    每張圖的 (正向, 反向) 樣式注入文字。同一組樣式只計算一次；
+    提供 seeds 時，含萬用字元或選擇群組的樣式以該圖的 seed 逐張展開。
+    """
+    cache = {}
+    injections = []
+    for i, assignment in enumerate(assignments):
+        cached = cache.get(assignment)
+        if cached is None:
+            expand = seeds is not None and styles_need_expansion(registry, assignment, language)
+            if not expand:
+                cached = (
+                    build_style_injection(assignment, lambda style, text: style_positive(registry, style, text, language)),
+                    build_style_injection(assignment, lambda style, text: style_negative(registry, style, text, language)),
+                )
+            cache[assignment] = cached or False
+        if cached:
+            injections.append(cached)
+            continue
+
+        rng = random.Random(seeds[i])
+        injections.append((
+            build_style_injection(assignment, lambda style, text: style_positive(registry, style, text, language, rng)),
+            build_style_injection(assignment, lambda style, text: style_negative(registry, style, text, language, rng)),
+        ))
+    return injections
+
+
+def build_style_injection(styles, create_func):
+    """組合多個樣式的注入文字（create_func 為 createPositive 或 createNegative）"""
+    injected_styles = [create_func(s, "") for s in styles if s]
+    return ", ".join([s for s in injected_styles if s]).strip(", ")
+
+
+def inject_style_text(original_prompt, style_injection, extra_text, style_at_beginning):
+    """將樣式文字與額外文字注入到原始提示的開頭或結尾"""
+    injection_parts = []
+    if style_injection:
+        injection_parts.append(style_injection)
+    if extra_text and extra_text.strip():
+        injection_parts.append(extra_text.strip())
+
+    injection = ", ".join(injection_parts)
+    if not injection:
+        return original_prompt
+    if style_at_beginning:
+        return f"{injection}, {original_prompt}"
+    return f"{original_prompt}, {injection}"
+
+
+PRESET_NONE = "None"
+
+
+class StylePresets:
+    """
+    具名的樣式組合（Style 1-4、Place Style At Beginning 與 Use Current Prompt as Style），
+    存放在 <樣式檔名>_presets.json，樣式以原始名稱記錄。
+    每個組合第一次使用時編譯成 (正向, 反向) 注入文字並快取；樣式庫更新後只有成員樣式變更或被刪除時才重新編譯。
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._files = {}
+        self._bundles = {}
+
+    def path_for(self, pack_path):
+        return os.path.join(self.directory, f"{pack_basename(pack_path)}_presets.json")
+
+    def load(self, pack_path):
+        """該樣式檔的所有組合（name -> preset），檔案修改後才重新讀取"""
+        path = self.path_for(pack_path)
+        try:
+            stat = os.stat(path)
+            stamp = (stat.st_mtime_ns, stat.st_size)
+        except OSError:
+            return {}
+        cached = self._files.get(path)
+        if cached is not None and cached[0] == stamp:
+            return cached[1]
+
+        presets = {}
+        try:
+            with open(path, 'rt', encoding="utf-8") as file:
+                for item in json.load(file):
+                    if isinstance(item, dict) and item.get('name'):
+                        presets[item['name']] = {
+                            "name": item['name'],
+                            "styles": [style for style in item.get('styles') or [] if style and style != 'base'][:4],
+                            "style_at_beginning": bool(item.get('style_at_beginning', False)),
+                            "use_current_prompt": bool(item.get('use_current_prompt', False)),
+                        }
+        except Exception as e:
+            print(f"Could not read presets: {e}")
+        self._files[path] = (stamp, presets)
+        return presets
+
+    def names(self, pack_path):
+        return [PRESET_NONE] + sorted(self.load(pack_path))
+
+    def get(self, pack_path, name):
+        if not name or name == PRESET_NONE:
+            return None
+        return self.load(pack_path).get(name)
+
+    def save(self, pack_path, name, styles, style_at_beginning=False, use_current_prompt=False):
+        presets = dict(self.load(pack_path))
+        presets[name] = {
+            "name": name,
+            "styles": [style for style in styles if style and style != 'base'][:4],
+            "style_at_beginning": bool(style_at_beginning),
+            "use_current_prompt": bool(use_current_prompt),
+        }
+        path = self.path_for(pack_path)
+        temp_path = f"{path}.tmp"
+        with open(temp_path, 'wt', encoding="utf-8") as file:
+            json.dump(list(presets.values()), file, ensure_ascii=False, indent=2)
+        os.replace(temp_path, path)
+
+    def display_styles(self, preset, registry, language):
+        """組合中的原始名稱轉成該語言的顯示名稱，補滿四個欄位"""
+        styles = []
+        for style in preset["styles"]:
+            record = registry.get(style) if registry is not None else None
+            styles.append(record.display_name(language) if record is not None else style)
+        return styles + ['base'] * (4 - len(styles))
+
+    def matches(self, preset, registry, language, styles, style_at_beginning, use_current_prompt):
+        """畫面上的 Style 1-4 與兩個選項是否仍是組合的內容（選擇組合後修改過任一項就不再相符）"""
+        return (preset_style_names(styles, registry, language) == list(preset["styles"])
+                and bool(style_at_beginning) == bool(preset["style_at_beginning"])
+                and bool(use_current_prompt) == bool(preset["use_current_prompt"]))
+
+    def bundle(self, registry, preset):
+        """
+        組合的 (正向, 反向) 注入文字。含 Random Select 或有成員樣式不存在時回傳 None，改走一般流程。
+        快取依樣式庫版本檢查；版本改變時比對成員樣式的記錄是否仍是同一個物件，相同就沿用。
+        """
+        if registry is None or "Random Select" in preset["styles"]:
+            return None
+        key = (registry.uid, preset["name"])
+        entry = self._bundles.get(key)
+        if entry is not None and entry[0] is preset and entry[1] == registry.revision:
+            return entry[3]
+
+        members = tuple(registry.get(style) for style in preset["styles"])
+        if any(record is None for record in members):
+            return None
+        if entry is not None and entry[0] is preset and all(old is new for old, new in zip(entry[2], members)):
+            bundle = entry[3]
+        else:
+            styles = preset["styles"]
+            bundle = (
+                build_style_injection(styles, lambda style, text: style_positive(registry, style, text)),
+                build_style_injection(styles, lambda style, text: style_negative(registry, style, text)),
+            )
+        self._bundles[key] = (preset, registry.revision, members, bundle)
+        return bundle
+
+
+style_presets = StylePresets(scripts.basedir())
+
+
+def preset_style_names(styles, registry, language):
+    """Style 1-4 的顯示名稱轉成組合儲存的原始名稱（略過 base），切換語言後仍然有效"""
+    styles = [style for style in styles if style and style != 'base']
+    if registry is not None:
+        styles = [style if style == "Random Select" else registry.original_name(style, language) for style in styles]
+    return styles
+
+
+def preset_injections(preset, registry, count, expand_templates=False):
+    """組合可以直接使用預先編譯的注入文字時，回傳每張圖的 (正向, 反向)；否則回傳 None"""
+    if preset is None or (expand_templates and styles_need_expansion(registry, preset["styles"], "default")):
+        return None
+    bundle = style_presets.bundle(registry, preset)
+    return [bundle] * count if bundle else None
+
+
+def group_styled_prompts(p):
+    """
+    重新排列每張圖的提示，讓相同的 prompt/negative 組合落在同一個 batch_size 子批次，
+    並在連續的迭代中出現，以便 webui 的 conditioning 快取重複使用。
+    seed、subseed 與 hires 提示會一起移動，保持每張圖的對應關係。
+    """
+    count = len(p.all_prompts)
+    if len(p.all_negative_prompts) != count:
+        return
+
+    batch_size = max(1, int(getattr(p, 'batch_size', 1) or 1))
+
+    groups = {}
+    for i, key in enumerate(zip(p.all_prompts, p.all_negative_prompts)):
+        groups.setdefault(key, []).append(i)
+    if len(groups) <= 1:
+        return
+
+    # 先放完整的子批次（同組連續），剩餘的部分依大小排列以減少跨批次分割
+    order = []
+    remainders = []
+    for indices in groups.values():
+        full = len(indices) - len(indices) % batch_size
+        order.extend(indices[:full])
+        if full < len(indices):
+            remainders.append(indices[full:])
+    remainders.sort(key=len, reverse=True)
+    for indices in remainders:
+        order.extend(indices)
+
+    if order == list(range(count)):
+        return
+
+    seen = set()
+    for attr in ('all_prompts', 'all_negative_prompts', 'all_seeds', 'all_subseeds', 'all_hr_prompts', 'all_hr_negative_prompts'):
+        values = getattr(p, attr, None)
+        if not isinstance(values, list) or len(values) != count or id(values) in seen:
+            continue
+        seen.add(id(values))
+        values[:] = [values[i] for i in order]
+
+
+
+def style_prompt_batch(items, styles, style_at_beginning=False, language="default", random_category="ALL",
+                       random_per_image=False, extra_prompt="", extra_negative_prompt="", registry=None, random_mode="Uniform",
+                       expand_templates=False, seed=None, preset=None):
+    """
+    不經過生成流程，直接為一批 (prompt, negative_prompt) 套用樣式。
+    回傳 [(prompt, negative_prompt, styles), ...]，與 process 的注入規則相同；
+    展開萬用字元時第 i 個項目使用 seed + i。指定 preset 時以該組合取代 styles 與 style_at_beginning，
+    找不到該 preset 時拋出 ValueError。
+    """
+    if registry is None:
+        registry = get_registry(stylespath)
+
+    items = list(items)
+    results = []
+    preset_name = preset
+    preset = style_presets.get(stylespath, preset_name)
+    if preset is None and preset_name and preset_name != PRESET_NONE:
+        raise ValueError(f"Unknown style preset: {preset_name}")
+    if preset is not None:
+        styles = style_presets.display_styles(preset, registry, language)
+        style_at_beginning = preset["style_at_beginning"]
+    assignments = resolve_style_assignments(styles, random_category, registry, len(items), random_per_image, random_mode, language)
+    style_rotation.save()
+    seeds = None
+    if expand_templates:
+        seed = random.getrandbits(32) if seed is None or seed < 0 else seed
+        seeds = [seed + i for i in range(len(items))]
+    injections = preset_injections(preset, registry, len(items), expand_templates)
+    if injections is None:
+        injections = build_injections(registry, assignments, language, seeds)
+    for (prompt, negative_prompt), assignment, (positive_injection, negative_injection) in zip(items, assignments, injections):
+        results.append((
+            inject_style_text(prompt or "", positive_injection, extra_prompt, style_at_beginning),
+            inject_style_text(negative_prompt or "", negative_injection, extra_negative_prompt, style_at_beginning),
+            list(assignment),
+        ))
+    return results
+
+
+def on_app_started(demo, app):
+    """註冊 REST API：列出樣式/分類（含 ETag 快取）與樣式組合，以及批次套用樣式"""
+    from typing import List, Optional
+
+    from fastapi import HTTPException, Request, Response
+    from pydantic import BaseModel, Field
+
+    class StylePair(BaseModel):
+        prompt: str = ""
+        negative_prompt: str = ""
+
+    class StyleBatchRequest(BaseModel):
+        items: List[StylePair] = Field(default_factory=list, description="Prompt/negative pairs to style")
+        styles: List[str] = Field(default_factory=list, description="Up to four style names, 'Random Select' allowed")
+        style_at_beginning: bool = False
+        language: str = "default"
+        random_category: str = "ALL"
+        random_per_image: bool = False
+        random_mode: str = "Uniform"
+        expand_templates: bool = False
+        seed: Optional[int] = None
+        extra_prompt: Optional[str] = ""
+        extra_negative_prompt: Optional[str] = ""
+        preset: Optional[str] = Field(None, description="Named preset; replaces styles and style_at_beginning")
+
+    def not_modified(request, etag):
+        return request.headers.get("if-none-match") == etag
+
+    @app.get("/styleselector/v1/styles")
+    def list_styles(request: Request, response: Response, language: str = "default"):
+        registry = get_registry(stylespath)
+        if registry is None:
+            return {"file": os.path.basename(stylespath), "styles": []}
+        etag = registry.etag(language)
+        if not_modified(request, etag):
+            return Response(status_code=304, headers={"ETag": etag})
+        response.headers["ETag"] = etag
+        return {
+            "file": os.path.basename(stylespath),
+            "styles": [
+                {
+                    "id": record.id or stable_style_id(record.name),
+                    "name": record.name,
+                    "display_name": record.display_name(language),
+                    "categories": [registry.categories[category_id] for category_id in record.category_ids],
+                }
+                for record in registry.records
+            ],
+        }
+
+    @app.get("/styleselector/v1/categories")
+    def list_categories(request: Request, response: Response):
+        registry = get_registry(stylespath)
+        if registry is None:
+            return {"categories": ["ALL"]}
+        etag = registry.etag()
+        if not_modified(request, etag):
+            return Response(status_code=304, headers={"ETag": etag})
+        response.headers["ETag"] = etag
+        return {"categories": registry.category_choices()}
+
+    @app.get("/styleselector/v1/presets")
+    def list_presets():
+        return {
+            "file": os.path.basename(style_presets.path_for(stylespath)),
+            "presets": list(style_presets.load(stylespath).values()),
+        }
+
+    @app.post("/styleselector/v1/style-batch")
+    def style_batch(payload: StyleBatchRequest):
+        wait_for_warmup()
+        if payload.preset and payload.preset != PRESET_NONE and style_presets.get(stylespath, payload.preset) is None:
+            raise HTTPException(status_code=404, detail=f"Unknown style preset: {payload.preset}")
+        results = style_prompt_batch(
+            [(item.prompt, item.negative_prompt) for item in payload.items],
+            payload.styles[:4],
+            style_at_beginning=payload.style_at_beginning,
+            language=payload.language,
+            random_category=payload.random_category,
+            random_per_image=payload.random_per_image,
+            random_mode=payload.random_mode,
+            expand_templates=payload.expand_templates,
+            seed=payload.seed,
+            extra_prompt=payload.extra_prompt or "",
+            extra_negative_prompt=payload.extra_negative_prompt or "",
+            preset=payload.preset,
+        )
+        return {
+            "items": [
+                {"prompt": prompt, "negative_prompt": negative_prompt, "styles": styles}
+                for prompt, negative_prompt, styles in results
+            ]
+        }
+
 
 def append_style_to_json(name, prompt, negative_prompt):
     global stylespath
     try:
-        with open(stylespath, 'r+', encoding='utf-8') as f:
+        with open_style_file(stylespath) as f:
             styles = json.load(f)
-            styles.append({
-                "name": name,
-                "prompt": prompt,
-                "negative_prompt": negative_prompt
-            })
-            f.seek(0)
+        item = {
+            "name": name,
+            "prompt": prompt,
+            "negative_prompt": negative_prompt
+        }
+        if isinstance(styles, dict):
+            # v2 樣式檔：補上 id 與預先計算的欄位
+            item = upgrade_style_pack([item])["styles"][0]
+        pack_items(styles).append(item)
+        # 壓縮的樣式檔以相同格式寫回
+        with open_style_file(stylespath, 'wt') as f:
             json.dump(styles, f, indent=2)
-            f.truncate()
+        invalidate_registry(stylespath)
     except Exception as e:
         print(f"Error saving style: {e}")
 
@@ -195,16 +2098,17 @@ def process_uploaded_json(file_obj):
         else:
             file_path = str(file_obj)
             
+        # 載入JSON內容（與目前的樣式庫比對，只更新差異）
+        registry, summary = update_registry_from_file(file_path, get_registry(stylespath))
+
         # 更新全域路徑
         stylespath = file_path
-        
-        # 載入JSON內容
-        json_data = get_json_content(file_path)
-        if json_data:
-            new_styles = read_sdxl_styles(json_data, current_language)
-            categories = get_categories(json_data)
+
+        if registry:
+            new_styles = registry.display_names(current_language)
+            categories = registry.category_choices()
             filename = os.path.basename(file_path)
-            return new_styles, categories, filename, f"Successfully loaded: {filename}"
+            return new_styles, categories, filename, f"Successfully loaded: {filename} ({summary})"
         else:
             return None, None, None, f"Failed to parse JSON file: {os.path.basename(file_path)}"
             
@@ -213,6 +2117,318 @@ def process_uploaded_json(file_obj):
         return None, None, None, f"Error processing file: {str(e)}"
 
 
+CSV_FIELDS = ["name", "prompt", "negative_prompt", "category", "namezh", "namejp"]
+
+
+class _JsonStream:
+    """在檔案上逐段解碼 JSON：只保留尚未處理的區塊，陣列可以逐項取出"""
+
+    def __init__(self, file, chunk_size=1 << 16):
+        self.file = file
+        self.chunk_size = chunk_size
+        self.decoder = json.JSONDecoder()
+        self.buffer = ""
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self):
+        # 丟掉已處理的部分並讀入下一塊
+        chunk = self.file.read(self.chunk_size)
+        self.buffer, self.pos = self.buffer[self.pos:] + chunk, 0
+        self.eof = not chunk
+
+    def peek(self):
+        """略過空白，回傳下一個字元（資料結束時為空字串）"""
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in " \t\r\n\ufeff":
+                self.pos += 1
+            if self.pos < len(self.buffer) or self.eof:
+                return self.buffer[self.pos:self.pos + 1]
+            self._fill()
+
+    def expect(self, chars):
+        char = self.peek()
+        if not char:
+            raise ValueError("Unexpected end of JSON data.")
+        if char not in chars:
+            raise ValueError(f"Unexpected character {char!r} in JSON data.")
+        self.pos += 1
+        return char
+
+    def value(self):
+        """解碼下一個完整的值"""
+        self.peek()
+        while True:
+            try:
+                item, end = self.decoder.raw_decode(self.buffer, self.pos)
+                # 數字可能剛好在區塊結尾被截斷，讀到下一個字元才算完整
+                complete = end < len(self.buffer) or self.eof
+            except ValueError:
+                if self.eof:
+                    raise
+                complete = False
+            if complete:
+                self.pos = end
+                return item
+            self._fill()
+
+    def items(self):
+        """逐項解碼目前位置的陣列"""
+        if self.peek() != "[":
+            raise ValueError("Invalid JSON data. Expected a list of templates.")
+        self.pos += 1
+        if self.peek() == "]":
+            self.pos += 1
+            return
+        while True:
+            yield self.value()
+            if self.expect(",]") == "]":
+                return
+
+
+def iter_pack_items(file):
+    """
+    逐項讀取樣式檔：v1 陣列與 v2 物件中的 styles 陣列都以串流解碼。
+    v2 的其他欄位（format、version）很小，直接解碼；styles 不必是最後一個欄位。
+    """
+    stream = _JsonStream(file)
+    if stream.peek() != "{":
+        yield from stream.items()
+        return
+
+    stream.pos += 1
+    found = False
+    if stream.peek() != "}":
+        while True:
+            key = stream.value()
+            stream.expect(":")
+            if key == "styles" and stream.peek() == "[":
+                yield from stream.items()
+                found = True
+            else:
+                value = stream.value()
+                if key == "version":
+                    check_pack_version(value)
+            if stream.expect(",}") == "}":
+                break
+    if not found:
+        raise ValueError("Invalid JSON data. Expected a list of templates.")
+
+
+def iter_csv_styles(csv_path):
+    """
+    逐行讀取 webui 的 styles.csv，轉成本擴充的樣式格式。
+    兩者都以 {prompt} 作為佔位符，category/namezh/namejp 來自額外欄位（若有）。
+    """
+    with open(csv_path, 'rt', encoding="utf-8-sig", newline='') as file:
+        for row in csv.DictReader(file):
+            name = row.get("name") or ""
+            if not name.strip():
+                continue
+            item = {
+                "name": name,
+                "prompt": row.get("prompt") or "",
+                "negative_prompt": row.get("negative_prompt") or "",
+            }
+            for field in ("category", "namezh", "namejp"):
+                if row.get(field):
+                    item[field] = row[field]
+            yield item
+
+
+def export_styles_csv(json_path, csv_path):
+    """將樣式 JSON 以串流方式轉成 webui 的 styles.csv（額外欄位保留 category/namezh/namejp），回傳樣式數"""
+    count = 0
+    with open_style_file(json_path) as source, open(csv_path, 'wt', encoding="utf-8-sig", newline='') as target:
+        writer = csv.DictWriter(target, fieldnames=CSV_FIELDS, extrasaction="ignore")
+        writer.writeheader()
+        for item in iter_pack_items(source):
+            if isinstance(item, dict) and 'name' in item:
+                row = {field: item.get(field) or "" for field in CSV_FIELDS}
+                # v2 樣式檔的分類是 categories 陣列，CSV 一律寫成以逗號分隔的 category
+                row["category"] = ", ".join(item_categories(item))
+                writer.writerow(row)
+                count += 1
+    return count
+
+
+def import_styles_csv(csv_path, json_path=None, target_path=None, registry=None):
+    """
+    以串流方式把 webui 的 styles.csv 附加到樣式檔 json_path 之後，寫到 target_path（預設寫回 json_path）。
+    樣式檔與 CSV 都逐項讀寫，只保留名稱與 id 的集合；名稱已存在的樣式略過。
+    v2 樣式檔的新樣式補上 id 與預先計算的欄位，壓縮的樣式檔以相同格式寫出；沒有 json_path 時寫出新的 v1 樣式檔。
+    registry 是 json_path 已載入的樣式庫時，新增的樣式直接加入其中，不必再解析一次輸出檔。
+    回傳 (新增數, 略過數)；沒有新樣式時不寫出檔案。
+    """
+    target_path = target_path or json_path
+    v2 = False
+    compression = None
+    if json_path:
+        with open_style_file(json_path) as file:
+            v2 = _JsonStream(file).peek() == "{"
+        compression = style_file_compression(json_path)
+
+    names = set()
+    used_ids = set()
+    added = []
+    skipped = 0
+    tmp_path = f"{target_path}.tmp"
+    try:
+        with contextlib.ExitStack() as stack:
+            target = stack.enter_context(open_style_file(tmp_path, 'wt', compression=compression))
+            target.write(f'{{"format": "{PACK_FORMAT}", "version": {PACK_VERSION}, "styles": [' if v2 else "[")
+            count = 0
+
+            def write(item):
+                nonlocal count
+                target.write(",\n  " if count else "\n  ")
+                target.write(json.dumps(item, ensure_ascii=False))
+                count += 1
+
+            if json_path:
+                for item in iter_pack_items(stack.enter_context(open_style_file(json_path))):
+                    if isinstance(item, dict):
+                        names.add(item.get('name'))
+                        used_ids.add(item.get('id'))
+                    write(item)
+            for item in iter_csv_styles(csv_path):
+                if item['name'] in names:
+                    skipped += 1
+                    continue
+                names.add(item['name'])
+                if v2:
+                    item = next(upgrade_style_items([item], used_ids))
+                write(item)
+                added.append(item)
+            target.write("\n]}\n" if v2 else "\n]\n")
+        if added:
+            os.replace(tmp_path, target_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+    if registry is not None and added:
+        registry.extend(added)
+    return len(added), skipped
+
+
+def save_current_styles_as_v2():
+    """將目前的樣式檔升級為 v2 格式並另存為 <name>.v2.json"""
+    json_data = get_json_content(stylespath)
+    if pack_items(json_data) is None:
+        return f"Could not read style file: {os.path.basename(stylespath)}"
+    name = pack_basename(stylespath)
+    if name.endswith(".v2"):
+        name = name[:-3]
+    target = os.path.join(scripts.basedir(), f"{name}.v2.json")
+    try:
+        upgraded = upgrade_style_pack(json_data)
+        with open(target, 'wt', encoding="utf-8") as file:
+            json.dump(upgraded, file, ensure_ascii=False, indent=2)
+    except Exception as e:
+        print(f"Error saving v2 style file: {e}")
+        return f"Error saving v2 style file: {e}"
+    return f"Saved {len(upgraded['styles'])} styles to {target}"
+
+
+def get_webui_styles_csv():
+    """webui 的 styles.csv 位置（新版可能設定多個，取第一個）"""
+    styles_file = getattr(getattr(shared, "cmd_opts", None), "styles_file", None)
+    if isinstance(styles_file, (list, tuple)):
+        styles_file = styles_file[0] if styles_file else None
+    if styles_file:
+        return styles_file
+    return os.path.join(os.path.dirname(os.path.dirname(scripts.basedir())), 'styles.csv')
+
+
+BUNDLED_PACKS = ("nsfw_styles.json", "sdxl_styles.json", "sdxl_styles_example.json")
+
+
+def user_pack_path(file_path):
+    """匯入時寫入的樣式檔：隨擴充附帶（受 git 管理）的樣式檔不直接修改，改寫到 <name>_imported.json"""
+    if os.path.basename(file_path) in BUNDLED_PACKS:
+        return os.path.join(scripts.basedir(), pack_basename(file_path) + "_imported.json")
+    return file_path
+
+
+def import_webui_styles():
+    """
+    把 webui 的 styles.csv 加入目前的樣式檔並切換到寫出的檔案。
+    附帶的樣式檔會先複製成 <name>_imported.json（已存在則加入該檔）；樣式檔中已有的名稱保留原本的內容，
+    所以重複匯入不會產生重複的樣式。新增的樣式直接加入已載入的樣式庫，不重新解析樣式檔。
+    """
+    global stylespath
+    csv_path = get_webui_styles_csv()
+    target = user_pack_path(stylespath)
+    source = target if os.path.exists(target) else stylespath
+    previous = get_registry(source)
+    if previous is None or not os.path.exists(csv_path):
+        return (gr.update(),) * 6 + (f"Could not import styles from: {csv_path}", gr.update())
+    wait_for_warmup()
+    try:
+        added, skipped = import_styles_csv(csv_path, source, target, previous)
+    except Exception as e:
+        print(f"Error importing styles.csv: {e}")
+        return (gr.update(),) * 6 + (f"Error importing styles.csv: {e}", gr.update())
+
+    if added or source != stylespath:
+        if added:
+            # 樣式庫已包含新增的樣式，改以寫出的檔案作為快取來源
+            stat = os.stat(target)
+            _registry_cache.pop(previous.source, None)
+            previous.source = target
+            _registry_cache[target] = ((stat.st_mtime_ns, stat.st_size), previous)
+            previous.start_keyword_index()
+        stylespath = target
+    registry = previous
+    new_styles = registry.display_names(current_language)
+    status = f"Imported {added} styles from {os.path.basename(csv_path)} into {os.path.basename(stylespath)}"
+    if skipped:
+        status += f" ({skipped} already present, skipped)"
+    return tuple(gr.Dropdown.update(choices=new_styles) for _ in range(4)) + (
+        gr.Dropdown.update(choices=registry.category_choices()),
+        os.path.basename(stylespath),
+        status,
+        gr.Dropdown.update(choices=style_presets.names(stylespath), value=PRESET_NONE),
+    )
+
+
+def export_current_styles():
+    """將目前的樣式檔匯出為 webui 格式的 CSV"""
+    csv_path = os.path.join(scripts.basedir(), pack_basename(stylespath) + "_styles.csv")
+    try:
+        count = export_styles_csv(stylespath, csv_path)
+    except Exception as e:
+        print(f"Error exporting styles: {e}")
+        return f"Error exporting styles: {e}"
+    return f"Exported {count} styles to {csv_path}"
+
+
+def convert_style_file(file_obj):
+    """
+    轉換選擇的檔案，不影響目前載入的樣式：styles.csv 轉成 <name>_converted.json，
+    樣式檔（v1/v2，可壓縮）轉成 <name>_styles.csv，都寫到擴充目錄。
+    """
+    if file_obj is None:
+        return gr.update()
+    file_path = getattr(file_obj, 'name', None) or str(file_obj)
+    name = pack_basename(file_path)
+    try:
+        if file_path.lower().endswith(".csv"):
+            target = os.path.join(scripts.basedir(), os.path.splitext(os.path.basename(file_path))[0] + "_converted.json")
+            count, skipped = import_styles_csv(file_path, target_path=target)
+            status = f"Converted {count} styles to {target}"
+            if skipped:
+                status += f" ({skipped} duplicate names skipped)"
+            return status
+        target = os.path.join(scripts.basedir(), name + "_styles.csv")
+        count = export_styles_csv(file_path, target)
+    except Exception as e:
+        print(f"Error converting style file: {e}")
+        return f"Error converting style file: {e}"
+    return f"Converted {count} styles to {target}"
+
+
 def open_json_file():
     global stylespath
     try:
@@ -239,7 +2455,8 @@ def update_styles_from_uploaded_file(file_obj):
             gr.Dropdown.update(choices=new_styles, value='base'),
             gr.Dropdown.update(choices=categories, value='ALL'),
             filename or "Unknown file",
-            status
+            status,
+            gr.Dropdown.update(choices=style_presets.names(stylespath), value=PRESET_NONE)
         )
     else:
         # 如果載入失敗，保持原狀
@@ -250,7 +2467,8 @@ def update_styles_from_uploaded_file(file_obj):
             gr.update(),
             gr.update(),
             gr.update(),
-            status or "File upload failed"
+            status or "File upload failed",
+            gr.update()
         )
 
 
@@ -259,14 +2477,65 @@ def update_language(language):
     global current_language
     current_language = language
     
-    json_data = get_json_content(stylespath)
-    if json_data:
-        new_styles = read_sdxl_styles(json_data, language)
+    registry = get_registry(stylespath)
+    if registry:
+        new_styles = registry.display_names(language)
         return gr.Dropdown.update(choices=new_styles, value='base')
     else:
         return gr.update()
 
 
+SUGGESTION_COUNT = 8
+
+
+def suggest_styles_func(text, language):
+    """依目前的提示詞推薦樣式，列在樣式下拉選單旁"""
+    registry = get_registry(stylespath)
+    if not registry or not text or not text.strip():
+        return gr.Dropdown.update(choices=[], value=None)
+    names = [record.display_name(language) for record in registry.suggest(text, SUGGESTION_COUNT)]
+    return gr.Dropdown.update(choices=names, value=None)
+
+
+def apply_suggested_style(suggestion, style1, style2, style3, style4):
+    """把選中的推薦樣式放到第一個仍為 base 的 Style 欄位（都已選用時取代 Style 4）"""
+    styles = [style1, style2, style3, style4]
+    if not suggestion or suggestion in styles:
+        return styles
+    for i, style in enumerate(styles):
+        if not style or style == 'base':
+            styles[i] = suggestion
+            return styles
+    styles[-1] = suggestion
+    return styles
+
+
+def apply_style_preset(name, language):
+    """選擇樣式組合時，把組合內容顯示在 Style 1-4 與兩個選項上"""
+    preset = style_presets.get(stylespath, name)
+    if preset is None:
+        return (gr.update(),) * 6
+    styles = style_presets.display_styles(preset, get_registry(stylespath), language)
+    return tuple(gr.Dropdown.update(value=style) for style in styles) + (
+        gr.update(value=preset["style_at_beginning"]),
+        gr.update(value=preset["use_current_prompt"]),
+    )
+
+
+def save_style_preset(name, style1, style2, style3, style4, style_at_beginning, use_current_prompt, language):
+    """把目前的 Style 1-4 與選項存成具名的樣式組合"""
+    name = (name or "").strip()
+    if not name or name == PRESET_NONE:
+        return gr.update(), "Enter a name for the preset"
+    styles = preset_style_names([style1, style2, style3, style4], get_registry(stylespath), language)
+    try:
+        style_presets.save(stylespath, name, styles, style_at_beginning, use_current_prompt)
+    except Exception as e:
+        print(f"Error saving preset: {e}")
+        return gr.update(), f"Error saving preset: {e}"
+    return gr.Dropdown.update(choices=style_presets.names(stylespath), value=name), f"Saved preset '{name}' ({len(styles)} styles)"
+
+
 def copy_styles_to_prompt_func(current_prompt, current_neg_prompt, style1, style2, style3, style4):
     """Copy selected non-base styles to prompt and reset styles to base"""
     current_prompt = current_prompt or ""
@@ -345,6 +2614,12 @@ class StyleSelectorXL(scripts.Script):
                         is_enabled = gr.Checkbox(value=enabled, label="Enable Style Selector")
                     with FormColumn(elem_id="Style At Beginning"):
                         style_at_beginning = gr.Checkbox(value=False, label="Place Style At Beginning")
+                    with FormColumn(min_width=160):
+                        random_per_image = gr.Checkbox(value=False, label="Random Select Per Image")
+                    with FormColumn(min_width=160):
+                        group_identical_prompts = gr.Checkbox(value=False, label="Group Identical Styled Prompts")
+                    with FormColumn(min_width=160):
+                        expand_style_templates = gr.Checkbox(value=False, label="Expand Wildcards And {a|b} In Styles")
 
                 # 語言選擇器
                 gr.Markdown("### Language Selection")
@@ -360,12 +2635,20 @@ class StyleSelectorXL(scripts.Script):
                 with FormRow():
                     with FormColumn(min_width=160):
                         # 初始化categories
-                        initial_json_data = get_json_content(stylespath) if stylespath else []
-                        initial_categories = get_categories(initial_json_data) if initial_json_data else ["ALL"]
+                        initial_registry = get_registry(stylespath)
+                        initial_categories = initial_registry.category_choices() if initial_registry else ["ALL"]
+                        # 也可以輸入布林運算式，例如 photo & !anime | cinematic
                         random_category = gr.Dropdown(
                             choices=initial_categories, 
                             value="ALL", 
-                            label="Random Category"
+                            label="Random Category",
+                            allow_custom_value=True
+                        )
+                    with FormColumn(min_width=160):
+                        random_mode = gr.Dropdown(
+                            choices=RANDOM_MODES,
+                            value="Uniform",
+                            label="Random Mode"
                         )
 
                 with FormRow():
@@ -378,13 +2661,29 @@ class StyleSelectorXL(scripts.Script):
                     with FormColumn(min_width=160):
                         style4 = gr.Dropdown(self.styleNames, value='base', multiselect=False, label="Style 4")
 
+                # 依提示詞推薦樣式
+                with FormRow():
+                    with FormColumn(min_width=300):
+                        style_suggestions = gr.Dropdown(choices=[], value=None, label="Suggested Styles")
+                    with FormColumn(min_width=200):
+                        suggest_button = gr.Button(value="Suggest Styles From Prompt", variant="secondary")
+
+                # 樣式組合
+                with FormRow():
+                    with FormColumn(min_width=200):
+                        style_preset = gr.Dropdown(choices=style_presets.names(stylespath), value=PRESET_NONE, label="Style Preset")
+                    with FormColumn(min_width=200):
+                        preset_name = gr.Textbox(label="Preset Name", placeholder="Name for the current styles", lines=1)
+                    with FormColumn(min_width=160):
+                        save_preset_button = gr.Button(value="Save Styles as Preset", variant="secondary")
+
                 # JSON file selection section
                 gr.Markdown("### Style File Management")
                 with FormRow():
                     with FormColumn(min_width=300):
                         json_file_upload = gr.File(
                             label="Upload JSON Style File", 
-                            file_types=[".json"],
+                            file_types=STYLE_FILE_TYPES,
                             file_count="single"
                         )
                     with FormColumn(min_width=200):
@@ -392,6 +2691,20 @@ class StyleSelectorXL(scripts.Script):
                     with FormColumn():
                         file_status = gr.Textbox(label="Current File", value="nsfw_styles.json", interactive=False)
                         
+                with FormRow():
+                    with FormColumn(min_width=200):
+                        import_csv_button = gr.Button(value="Import webui styles.csv", variant="secondary")
+                    with FormColumn(min_width=200):
+                        export_csv_button = gr.Button(value="Export Current Styles to CSV", variant="secondary")
+                    with FormColumn(min_width=200):
+                        save_v2_button = gr.Button(value="Save Current Styles as v2", variant="secondary")
+                    with FormColumn(min_width=300):
+                        convert_file_upload = gr.File(
+                            label="Convert File (styles.csv to JSON, style file to CSV)",
+                            file_types=[".csv"] + STYLE_FILE_TYPES,
+                            file_count="single"
+                        )
+
                 with FormRow():
                     upload_status = gr.Textbox(label="Upload Status", lines=1, interactive=False)
 
@@ -422,13 +2735,66 @@ class StyleSelectorXL(scripts.Script):
                     outputs=[style1]
                 )
                         
+                # 推薦樣式：使用 Current Prompt，空白時改用主要的提示輸入框
+                suggest_button.click(
+                    fn=suggest_styles_func,
+                    inputs=[prompt_preview, language_selector],
+                    outputs=[style_suggestions],
+                    _js="""
+                    function(current_prompt, language) {
+                        if (!current_prompt || !current_prompt.trim()) {
+                            const mainPromptInput = document.querySelector('#txt2img_prompt textarea, #img2img_prompt textarea');
+                            current_prompt = mainPromptInput ? mainPromptInput.value : '';
+                        }
+                        return [current_prompt, language];
+                    }
+                    """
+                )
+                style_preset.change(
+                    fn=apply_style_preset,
+                    inputs=[style_preset, language_selector],
+                    outputs=[style1, style2, style3, style4, style_at_beginning, use_current_prompt]
+                )
+                save_preset_button.click(
+                    fn=save_style_preset,
+                    inputs=[preset_name, style1, style2, style3, style4, style_at_beginning, use_current_prompt, language_selector],
+                    outputs=[style_preset, upload_status]
+                )
+                style_suggestions.change(
+                    fn=apply_suggested_style,
+                    inputs=[style_suggestions, style1, style2, style3, style4],
+                    outputs=[style1, style2, style3, style4]
+                )
+
                 # Set up JSON file upload functionality
                 json_file_upload.change(
                     fn=update_styles_from_uploaded_file,
                     inputs=[json_file_upload],
-                    outputs=[style1, style2, style3, style4, random_category, file_status, upload_status]
+                    outputs=[style1, style2, style3, style4, random_category, file_status, upload_status, style_preset]
                 )
                 
+                # styles.csv 匯入/匯出
+                import_csv_button.click(
+                    fn=import_webui_styles,
+                    inputs=[],
+                    outputs=[style1, style2, style3, style4, random_category, file_status, upload_status, style_preset]
+                )
+                export_csv_button.click(
+                    fn=export_current_styles,
+                    inputs=[],
+                    outputs=[upload_status]
+                )
+                save_v2_button.click(
+                    fn=save_current_styles_as_v2,
+                    inputs=[],
+                    outputs=[upload_status]
+                )
+                convert_file_upload.change(
+                    fn=convert_style_file,
+                    inputs=[convert_file_upload],
+                    outputs=[upload_status]
+                )
+
                 # Set up open JSON file functionality
                 open_button.click(
                     fn=lambda: open_json_file(),
@@ -488,96 +2854,66 @@ class StyleSelectorXL(scripts.Script):
                     """
                 )
                 
-        return [is_enabled, style_at_beginning, use_current_prompt, prompt_preview, neg_prompt_preview, style1, style2, style3, style4, language_selector, random_category, file_status, upload_status]
+        return [is_enabled, style_at_beginning, use_current_prompt, prompt_preview, neg_prompt_preview, style1, style2, style3, style4, language_selector, random_category, file_status, upload_status, random_per_image, group_identical_prompts, random_mode, expand_style_templates, style_preset]
 
 
-    def process(self, p, is_enabled, style_at_beginning, use_current_prompt, current_prompt_text, current_neg_prompt_text, style1, style2, style3, style4, language_selector, random_category, file_status, upload_status):
+    def process(self, p, is_enabled, style_at_beginning, use_current_prompt, current_prompt_text, current_neg_prompt_text, style1, style2, style3, style4, language_selector, random_category, file_status, upload_status, random_per_image=False, group_identical_prompts=False, random_mode="Uniform", expand_style_templates=False, style_preset=PRESET_NONE):
         if not is_enabled:
             return
 
         global current_language
         current_language = language_selector
 
+        wait_for_warmup()
         batchCount = len(p.all_prompts)
+        registry = get_registry(stylespath)
+
+        # 選擇組合時已把內容填入 Style 1-4 與兩個選項，一律以畫面上的設定為準；
+        # 設定仍與組合相同時才使用組合預先建立的注入文字，之後修改過任一項就視為沒有選擇組合
+        styles = [style1, style2, style3, style4]
+        preset = style_presets.get(stylespath, style_preset)
+        if preset is not None and not style_presets.matches(
+                preset, registry, current_language, styles, style_at_beginning, use_current_prompt):
+            preset = None
 
         # Gather selected styles and handle Random Select
-        selected_styles = []
-        json_data = get_json_content(stylespath)
-        
-        for style in [style1, style2, style3, style4]:
-            if style and style != 'base':
-                if style == "Random Select":
-                    # 根據Random Category進行隨機選擇
-                    random_style = get_random_style_by_category(random_category, json_data, current_language)
-                    if random_style:
-                        selected_styles.append(random_style)
-                else:
-                    selected_styles.append(style)
+        # 每張圖各自隨機時，為每張圖產生一組樣式；否則整批共用同一組
+        assignments = resolve_style_assignments(styles, random_category, registry, batchCount, random_per_image, random_mode)
+        style_rotation.save()
+
+        # 整批共用同一組時保留原本的順序與重複項；每張圖各自隨機時列出所有用到的樣式
+        selected_styles = list(assignments[0]) if assignments else []
+        if random_per_image:
+            selected_styles = []
+            for assignment in assignments:
+                for style in assignment:
+                    if style not in selected_styles:
+                        selected_styles.append(style)
 
         print(f"Total batch count: {batchCount}")
         print(f"Selected styles: {selected_styles}")
         print(f"Random category: {random_category}")
         print(f"Current language: {current_language}")
 
+        current_prompt_extra = current_prompt_text if use_current_prompt else ""
+        current_neg_extra = current_neg_prompt_text if use_current_prompt else ""
+        injections = preset_injections(preset, registry, batchCount, expand_style_templates)
+        if injections is None:
+            injections = build_injections(registry, assignments, current_language, p.all_seeds if expand_style_templates else None)
+
         # Inject positive prompts
         for i, original_prompt in enumerate(p.all_prompts):
-            injected_styles = [createPositive(s, "") for s in selected_styles if s]
-            injection_parts = []
-            
-            print(f"Processing prompt {i}: styles = {selected_styles}")
-            print(f"Injected styles for prompt {i}: {injected_styles}")
-            
-            # Add style prompts
-            style_injection = ", ".join([s for s in injected_styles if s]).strip(", ")
-            if style_injection:
-                injection_parts.append(style_injection)
-            
-            # Add current prompt text if enabled
-            if use_current_prompt and current_prompt_text and current_prompt_text.strip():
-                injection_parts.append(current_prompt_text.strip())
-            
-            # Combine all injections
-            injection = ", ".join(injection_parts)
-            
-            if injection:
-                if style_at_beginning:
-                    p.all_prompts[i] = f"{injection}, {original_prompt}"
-                else:
-                    p.all_prompts[i] = f"{original_prompt}, {injection}"
-                print(f"Final prompt {i}: {p.all_prompts[i]}")
-            else:
-                p.all_prompts[i] = original_prompt
-                print(f"No injection for prompt {i}: {p.all_prompts[i]}")
+            p.all_prompts[i] = inject_style_text(original_prompt, injections[i][0], current_prompt_extra, style_at_beginning)
+            print(f"Final prompt {i}: {p.all_prompts[i]}")
 
         # Inject negative prompts
         for i, original_prompt in enumerate(p.all_negative_prompts):
-            injected_styles = [createNegative(s, "") for s in selected_styles if s]
-            injection_parts = []
-            
-            print(f"Processing negative prompt {i}: styles = {selected_styles}")
-            print(f"Injected negative styles for prompt {i}: {injected_styles}")
-            
-            # Add style prompts
-            style_injection = ", ".join([s for s in injected_styles if s]).strip(", ")
-            if style_injection:
-                injection_parts.append(style_injection)
-            
-            # Add current negative prompt text if enabled
-            if use_current_prompt and current_neg_prompt_text and current_neg_prompt_text.strip():
-                injection_parts.append(current_neg_prompt_text.strip())
-            
-            # Combine all injections
-            injection = ", ".join(injection_parts)
-            
-            if injection:
-                if style_at_beginning:
-                    p.all_negative_prompts[i] = f"{injection}, {original_prompt}"
-                else:
-                    p.all_negative_prompts[i] = f"{original_prompt}, {injection}"
-                print(f"Final negative prompt {i}: {p.all_negative_prompts[i]}")
-            else:
-                p.all_negative_prompts[i] = original_prompt
-                print(f"No negative injection for prompt {i}: {p.all_negative_prompts[i]}")
+            negative_injection = injections[i][1] if i < len(injections) else ""
+            p.all_negative_prompts[i] = inject_style_text(original_prompt, negative_injection, current_neg_extra, style_at_beginning)
+            print(f"Final negative prompt {i}: {p.all_negative_prompts[i]}")
+
+        if group_identical_prompts:
+            group_styled_prompts(p)
 
         # Metadata
         p.extra_generation_params.update({
@@ -588,6 +2924,16 @@ class StyleSelectorXL(scripts.Script):
             "Style Selector Random Category": random_category,
             "Style Selector Styles Used": ", ".join(selected_styles)
         })
+        if random_per_image:
+            p.extra_generation_params["Style Selector Random Per Image"] = True
+        if random_mode != "Uniform":
+            p.extra_generation_params["Style Selector Random Mode"] = random_mode
+        if expand_style_templates:
+            p.extra_generation_params["Style Selector Expand Templates"] = True
+        if group_identical_prompts:
+            p.extra_generation_params["Style Selector Grouped Prompts"] = True
+        if preset is not None:
+            p.extra_generation_params["Style Selector Preset"] = preset["name"]
 
 
 
@@ -597,5 +2943,10 @@ def on_ui_settings():
         "select-list", "How should Style Names Rendered on UI", gr.Radio, {"choices": ["radio-buttons", "select-list"]}, section=section))
     
     shared.opts.add_option("enable_styleselector_by_default", shared.OptionInfo(True, "Enable Style Selector by default", gr.Checkbox, section=section))
+
+    shared.opts.add_option("styleselector_wildcards_dir", shared.OptionInfo(
+        "", "Wildcards directory for __name__ in styles (empty: extension's wildcards folder, restart required)", gr.Textbox, section=section))
     
-script_callbacks.on_ui_settings(on_ui_settings)
\ No newline at end of file
+script_callbacks.on_ui_settings(on_ui_settings)
+script_callbacks.on_app_started(on_app_started)
+script_callbacks.on_app_started(start_registry_warmup)
@@ -0,0 +1,203 @@
+"""
+Measure what the extension costs at startup and in memory:
+
+- import time (and tracemalloc peak) of ``scripts/StyleSelectorXL.py`` against the
+  stubbed ``modules``/``gradio``, each run in a fresh interpreter;
+- time for ``ui()`` to build the txt2img and img2img tabs (stub components, so
+  this is the extension's own work, not gradio's);
+- load time, tracemalloc peak and retained memory of reading a style pack from
+  disk, and the same for warming up the indexes generation uses, for growing pack
+  sizes, plus the time of the keyword index that is built in the background.
+
+    python tools/benchmark_footprint.py --sizes 155 10000 100000 --json footprint.json
+    python tools/benchmark_footprint.py --budget footprint_budget.json
+
+A budget file maps flattened report keys to maximum values, for example
+``{"import.ms": 500, "libraries.100000.load_retained_kib": 80000}``; the script
+exits with status 1 when any of them is exceeded.
+"""
+import argparse
+import contextlib
+import gc
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import webui_stubs
+from benchmark_registry_memory import make_library
+
+TOOLS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def child_startup(trace_memory):
+    """在新的直譯器中執行：匯入擴充與建立兩個分頁的 UI，輸出 JSON"""
+    result = {}
+    if trace_memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    extension = webui_stubs.load_extension()
+    result["import_ms"] = (time.perf_counter() - start) * 1000
+    if trace_memory:
+        result["import_peak_kib"] = tracemalloc.get_traced_memory()[1] / 1024
+        tracemalloc.stop()
+        return result
+
+    script = extension.StyleSelectorXL()
+    for tab, is_img2img in (("txt2img", False), ("img2img", True)):
+        start = time.perf_counter()
+        script.ui(is_img2img)
+        result[f"{tab}_ms"] = (time.perf_counter() - start) * 1000
+    return result
+
+
+def run_child(trace_memory):
+    command = [sys.executable, os.path.abspath(__file__), "--child", "traced" if trace_memory else "timed"]
+    output = subprocess.run(command, check=True, capture_output=True, text=True, cwd=TOOLS_DIR).stdout
+    # 匯入時擴充本身也會輸出訊息，結果在最後一行
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def measure_startup(repeat):
+    runs = [run_child(False) for _ in range(repeat)]
+    memory = run_child(True)
+    return (
+        {"ms": statistics.median(run["import_ms"] for run in runs), "peak_kib": memory["import_peak_kib"]},
+        {tab: statistics.median(run[f"{tab}_ms"] for run in runs) for tab in ("txt2img", "img2img")},
+    )
+
+
+def timed(action):
+    gc.collect()
+    start = time.perf_counter()
+    result = action()
+    return result, (time.perf_counter() - start) * 1000
+
+
+def traced(action):
+    """回傳 (結果, 保留的記憶體 KiB, 尖峰 KiB)；tracemalloc 會拖慢執行，所以時間另外量測"""
+    gc.collect()
+    tracemalloc.start()
+    result = action()
+    gc.collect()
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, retained / 1024, peak / 1024
+
+
+def measure_libraries(extension, sizes, directory):
+    results = []
+    for size in sizes:
+        path = os.path.join(directory, f"footprint_{size}.json")
+        with open(path, 'wt', encoding="utf-8") as file:
+            file.write(make_library(size))
+
+        registry, load_ms = timed(lambda: extension.get_registry(path))
+        assert len(registry) == size
+        _, warm_ms = timed(registry.warm_up)
+        _, keyword_ms = timed(registry.keyword_index)
+        del registry
+        extension.invalidate_registry(path)
+
+        registry, load_retained, load_peak = traced(lambda: extension.get_registry(path))
+        _, warm_retained, warm_peak = traced(registry.warm_up)
+        results.append({
+            "styles": size,
+            "file_kib": os.path.getsize(path) / 1024,
+            "load_ms": load_ms,
+            "load_retained_kib": load_retained,
+            "load_peak_kib": load_peak,
+            "warm_up_ms": warm_ms,
+            "warm_up_retained_kib": warm_retained,
+            "warm_up_peak_kib": warm_peak,
+            "keyword_index_ms": keyword_ms,
+        })
+        del registry
+        extension.invalidate_registry(path)
+        os.remove(path)
+    return results
+
+
+def flatten(report, prefix=""):
+    values = {}
+    for key, value in report.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            values.update(flatten(value, f"{name}."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            values[name] = value
+    return values
+
+
+def check_budget(report, budget_path):
+    with open(budget_path, 'rt', encoding="utf-8") as file:
+        budget = json.load(file)
+    values = flatten(report)
+    violations = []
+    for key, limit in budget.items():
+        if key not in values:
+            violations.append(f"{key}: not measured")
+        elif values[key] > limit:
+            violations.append(f"{key}: {values[key]:.1f} > {limit}")
+    return violations
+
+
+def print_report(report):
+    print(f"import: {report['import']['ms']:.1f} ms, peak {report['import']['peak_kib']:.0f} KiB")
+    print(f"ui(): txt2img {report['ui']['txt2img']:.1f} ms, img2img {report['ui']['img2img']:.1f} ms")
+    print(f"{'styles':>8} {'file KiB':>9} {'load ms':>9} {'retained KiB':>13} {'peak KiB':>9} "
+          f"{'warm ms':>9} {'+retained KiB':>14} {'peak KiB':>9} {'keyword ms':>11}")
+    for library in report["libraries"].values():
+        print(f"{library['styles']:>8} {library['file_kib']:>9.0f} {library['load_ms']:>9.1f} "
+              f"{library['load_retained_kib']:>13.0f} {library['load_peak_kib']:>9.0f} {library['warm_up_ms']:>9.1f} "
+              f"{library['warm_up_retained_kib']:>14.0f} {library['warm_up_peak_kib']:>9.0f} "
+              f"{library['keyword_index_ms']:>11.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[155, 1000, 10000, 100000])
+    parser.add_argument("--repeat", type=int, default=5, help="fresh interpreters for the import/ui timings (median)")
+    parser.add_argument("--json", help="write the report to this file")
+    parser.add_argument("--budget", help="JSON file of maximum values per report key")
+    parser.add_argument("--child", choices=["timed", "traced"], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(child_startup(args.child == "traced")))
+        return 0
+
+    import_stats, ui_stats = measure_startup(args.repeat)
+    with tempfile.TemporaryDirectory() as directory:
+        with contextlib.redirect_stdout(io.StringIO()):
+            extension = webui_stubs.load_extension(basedir=directory)
+        libraries = measure_libraries(extension, args.sizes, directory)
+
+    report = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "import": import_stats,
+        "ui": ui_stats,
+        "libraries": {str(library["styles"]): library for library in libraries},
+    }
+    print_report(report)
+    if args.json:
+        with open(args.json, 'wt', encoding="utf-8") as file:
+            json.dump(report, file, indent=2)
+
+    if args.budget:
+        violations = check_budget(report, args.budget)
+        for violation in violations:
+            print(f"Over budget: {violation}")
+        return 1 if violations else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,70 @@
+"""
+Compare the memory retained by a style library held as a list of dicts of
+strings (plain ``json.load`` output) against the same library loaded into
+``StyleRegistry``.
+
+    python tools/benchmark_registry_memory.py --sizes 155 10000 100000
+"""
+import argparse
+import gc
+import json
+import random
+import tracemalloc
+
+import webui_stubs
+
+NEGATIVES = [
+    "blurry, noisy, lowres, bad anatomy",
+    "worst quality, low quality, jpeg artifacts, watermark, signature",
+    "text, logo, cropped, out of frame, deformed, disfigured",
+    "",
+]
+CATEGORIES = ["photo", "anime", "cinematic", "painting", "photo, cinematic", "anime, painting", ""]
+
+
+def make_library(size, seed=0):
+    """Synthetic pack: unique names/prompts, negatives and categories drawn from small pools."""
+    rng = random.Random(seed)
+    library = []
+    for i in range(size):
+        library.append({
+            "name": f"style {i:06d}",
+            "namezh": f"風格 {i:06d}",
+            "namejp": f"スタイル {i:06d}",
+            "prompt": f"{{prompt}}, style {i}, {rng.choice(['soft light', 'hard light', 'rim light'])}",
+            "negative_prompt": rng.choice(NEGATIVES),
+            "category": rng.choice(CATEGORIES),
+        })
+    return json.dumps(library, ensure_ascii=False)
+
+
+def measure(build):
+    gc.collect()
+    tracemalloc.start()
+    result = build()
+    gc.collect()
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, retained, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[155, 10000, 100000])
+    args = parser.parse_args()
+
+    extension = webui_stubs.load_extension()
+    print(f"{'styles':>8} {'dicts (KiB)':>12} {'registry (KiB)':>15} {'ratio':>6} {'peak (KiB)':>11}")
+    for size in args.sizes:
+        text = make_library(size)
+        baseline, baseline_retained, _ = measure(lambda: json.loads(text))
+        del baseline
+        registry, registry_retained, registry_peak = measure(lambda: extension.StyleRegistry(json.loads(text)))
+        assert len(registry) == size
+        del registry
+        print(f"{size:>8} {baseline_retained / 1024:>12.0f} {registry_retained / 1024:>15.0f} "
+              f"{registry_retained / baseline_retained:>6.2f} {registry_peak / 1024:>11.0f}")
+
+
+if __name__ == "__main__":
+    main()
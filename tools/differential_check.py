@@ -0,0 +1,366 @@
+"""
+Differential fuzz check: generate random style packs and prompt batches and
+compare the extension's prompt building against the frozen pre-registry logic
+in ``legacy_engine.py``. Any difference in the produced prompts, metadata or
+random number consumption is reported and the script exits with status 1.
+
+Each iteration also
+
+- gives the extension the pack as v1 or v2, plain or compressed (gzip, and zstd
+  when ``zstandard`` is installed), while the legacy code reads the same styles
+  as a plain v1 file; some styles carry an explicit ``"weight": 1``;
+- compares Random Category boolean expressions against the legacy category
+  pick on the styles that match the expression;
+- exports the pack to a webui ``styles.csv`` and checks that reading the CSV
+  back gives the same styles (names, prompts, categories, localized names);
+- uploads an edited copy of the pack (styles removed, reordered, changed and
+  added) through ``process_uploaded_json``, so the registry is updated in place
+  by ``apply_update``, and repeats the checks against the legacy code on the
+  edited file.
+
+    python tools/differential_check.py --iterations 500 --seed 0
+"""
+import argparse
+import contextlib
+import gzip
+import io
+import json
+import os
+import random
+import sys
+import tempfile
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+import legacy_engine
+import webui_stubs
+
+WORDS = ["cinematic", "portrait", "neon", "film grain", "soft light", "bokeh", "watercolor", "ink",
+         "anime", "low poly", "isometric", "{a|b}", "__color__", "dramatic", "pastel", "8k"]
+ZH_NAMES = ["電影", "肖像", "霓虹", "水彩", "動漫", "復古"]
+JP_NAMES = ["シネマ", "ポートレート", "ネオン", "水彩", "アニメ", "レトロ"]
+CATEGORIES = ["photo", "anime", "cinematic", "painting", "3d"]
+LANGUAGES = ["default", "chinese", "japanese"]
+
+
+def random_text(rng, low=0, high=4):
+    return ", ".join(rng.choice(WORDS) for _ in range(rng.randint(low, high)))
+
+
+def random_category(rng):
+    roll = rng.random()
+    if roll < 0.15:
+        return None
+    if roll < 0.25:
+        return ""
+    parts = rng.sample(CATEGORIES, rng.randint(1, 3))
+    # 多餘的空白與空項目
+    if rng.random() < 0.3:
+        parts.insert(rng.randrange(len(parts) + 1), " ")
+    separator = rng.choice([",", ", ", " , "])
+    return separator.join(parts)
+
+
+def make_pack(rng):
+    """隨機樣式包：在地化名稱（可能與其他樣式的名稱衝突）、缺少 {prompt}、空白反向提示、多重category"""
+    size = rng.randint(0, 25)
+    names = [f"{rng.choice(WORDS)} {i}" for i in range(size)]
+    # 偶爾出現重複名稱，舊版以第一個符合的樣式為準
+    for i in range(1, size):
+        if rng.random() < 0.05:
+            names[i] = names[rng.randrange(i)]
+    pack = []
+    for i, name in enumerate(names):
+        parts = [rng.choice(WORDS) for _ in range(rng.randint(1, 4))]
+        for _ in range(rng.choice([0, 1, 1, 1, 2])):
+            parts.insert(rng.randrange(len(parts) + 1), "{prompt}")
+        prompt = rng.choice([", ", " ", ","]).join(parts)
+        item = {"name": name, "prompt": prompt}
+        if rng.random() < 0.8:
+            item["negative_prompt"] = random_text(rng) if rng.random() < 0.7 else ""
+        for key, pool in (("namezh", ZH_NAMES), ("namejp", JP_NAMES)):
+            roll = rng.random()
+            if roll < 0.5:
+                item[key] = f"{rng.choice(pool)} {i}"
+            elif roll < 0.6 and names:
+                item[key] = rng.choice(names)
+            elif roll < 0.7:
+                item[key] = ""
+        category = random_category(rng)
+        if category is not None:
+            item["category"] = category
+        # 權重 1 與未設定權重相同，抽選結果必須與舊版一致
+        if rng.random() < 0.1:
+            item["weight"] = 1
+        pack.append(item)
+    return pack
+
+
+def edit_pack(rng, pack):
+    """
+    重新上傳用的修改版：刪除、調換順序、修改內容並加入新的樣式。
+    一半的情況只修改內容、名稱與順序不變，走就地更新的路徑。
+    """
+    in_place = rng.random() < 0.5
+    edited = [dict(item) for item in pack if in_place or rng.random() >= 0.15]
+    for _ in range(0 if in_place else rng.randint(0, 3)):
+        if len(edited) >= 2:
+            i, j = rng.randrange(len(edited)), rng.randrange(len(edited))
+            edited[i], edited[j] = edited[j], edited[i]
+    for item in edited:
+        roll = rng.random()
+        if roll < 0.1:
+            item["prompt"] = item["prompt"] + ", " + rng.choice(WORDS)
+        elif roll < 0.15:
+            item["negative_prompt"] = random_text(rng)
+        elif roll < 0.2:
+            category = random_category(rng)
+            if category is None:
+                item.pop("category", None)
+            else:
+                item["category"] = category
+        elif roll < 0.25:
+            item["namezh"] = f"{rng.choice(ZH_NAMES)} {rng.randrange(100)}"
+    for item in make_pack(rng)[:0 if in_place else rng.randint(0, 3)]:
+        item["name"] = f"new {item['name']}"
+        edited.insert(rng.randrange(len(edited) + 1), item)
+    return edited
+
+
+PACK_FORMATS = ["v1", "v2", "v1.gz", "v2.gz"] + (["v2.zst"] if zstandard is not None else [])
+
+
+def write_pack(ext, path, pack, pack_format):
+    """依指定格式寫出樣式檔給擴充讀取（舊版另外讀取純 v1 檔）"""
+    data = ext.upgrade_style_pack(pack) if pack_format.startswith("v2") else pack
+    text = json.dumps(data, ensure_ascii=False)
+    if pack_format.endswith(".gz"):
+        path += ".gz"
+        with gzip.open(path, 'wt', encoding="utf-8") as file:
+            file.write(text)
+    elif pack_format.endswith(".zst"):
+        path += ".zst"
+        with open(path, 'wb') as file:
+            file.write(zstandard.ZstdCompressor().compress(text.encode("utf-8")))
+    else:
+        with open(path, 'wt', encoding="utf-8") as file:
+            file.write(text)
+    return path
+
+
+def random_expression(rng, depth=0):
+    """
+    隨機的category運算式，回傳 (字串, 判斷函式, 最外層運算子)。
+    子式只在優先順序需要時才加括號，以測試 ! > & > | 的優先順序。
+    """
+    roll = rng.random()
+    if depth >= 2 or roll < 0.3:
+        category = rng.choice(CATEGORIES + ["missing"])
+        return category, lambda categories: category in categories, None
+    if roll < 0.45:
+        text, test, kind = random_expression(rng, depth + 1)
+        text = f"!({text})" if kind in ("&", "|") else f"!{text}"
+        return text, lambda categories: not test(categories), "!"
+    operator = rng.choice(["&", "|"])
+    parts = []
+    tests = []
+    for _ in range(2):
+        text, test, kind = random_expression(rng, depth + 1)
+        if (operator == "&" and kind == "|") or (kind in ("&", "|") and rng.random() < 0.3):
+            text = f"({text})"
+        parts.append(text)
+        tests.append(test)
+    left_test, right_test = tests
+    text = f" {operator} ".join(parts)
+    if operator == "&":
+        return text, lambda categories: left_test(categories) and right_test(categories), operator
+    return text, lambda categories: left_test(categories) or right_test(categories), operator
+
+
+def legacy_categories(item):
+    category = item.get('category')
+    return [cat.strip() for cat in category.split(',') if cat.strip()] if category else []
+
+
+def display_names(pack, language):
+    key = {"chinese": "namezh", "japanese": "namejp"}.get(language)
+    return [item.get(key) or item["name"] if key else item["name"] for item in pack]
+
+
+def random_style(rng, pack, language):
+    roll = rng.random()
+    if roll < 0.2 or not pack:
+        return rng.choice(["base", "", None, "Random Select", "missing style"])
+    item = rng.choice(pack)
+    # 偶爾用另一個語言的顯示名稱，測試對應失敗時的行為
+    return rng.choice(display_names([item], rng.choice(LANGUAGES) if rng.random() < 0.2 else language))
+
+
+class Checker:
+    def __init__(self, ext):
+        self.ext = ext
+        self.failures = 0
+
+    def compare(self, label, expected, actual):
+        if expected != actual:
+            self.failures += 1
+            print(f"MISMATCH {label}\n  legacy: {expected!r}\n  engine: {actual!r}")
+
+    def run(self, label, seed, legacy_call, engine_call):
+        """以相同的隨機種子執行兩邊，比較結果與之後的隨機數狀態"""
+        with contextlib.redirect_stdout(io.StringIO()):
+            random.seed(seed)
+            expected = legacy_call()
+            expected_state = random.random()
+            random.seed(seed)
+            actual = engine_call()
+            actual_state = random.random()
+        self.compare(label, expected, actual)
+        self.compare(f"{label} (random state)", expected_state, actual_state)
+
+
+def check_pack(checker, rng, label, pack, engine_styles):
+    """
+    比較目前樣式檔（擴充讀 ext.stylespath，舊版讀 legacy_engine.stylespath）的提示詞組合；
+    engine_styles 是擴充端傳給 get_random_style_by_category 等函式的樣式資料（list 或樣式庫）。
+    """
+    ext = checker.ext
+    seed = rng.getrandbits(32)
+    for language in LANGUAGES:
+        legacy_engine.current_language = ext.current_language = language
+        styles = display_names(pack, language) + ["Random Select", "missing style"]
+        for style in styles:
+            text = random_text(rng)
+            style_label = f"{label} {language} {style!r}"
+            checker.run(f"{style_label} createPositive", seed,
+                        lambda: legacy_engine.createPositive(style, text), lambda: ext.createPositive(style, text))
+            checker.run(f"{style_label} createNegative", seed,
+                        lambda: legacy_engine.createNegative(style, text), lambda: ext.createNegative(style, text))
+            checker.compare(f"{style_label} get_original_name_from_display",
+                            legacy_engine.get_original_name_from_display(style, pack, language),
+                            ext.get_original_name_from_display(style, engine_styles, language))
+
+        for category in ["ALL", "missing"] + CATEGORIES:
+            checker.run(f"{label} {language} get_random_style_by_category({category!r})", seed,
+                        lambda: legacy_engine.get_random_style_by_category(category, pack, language),
+                        lambda: ext.get_random_style_by_category(category, engine_styles, language))
+
+        # 運算式的結果應等於舊版從符合條件的樣式中抽選
+        for _ in range(2):
+            expression, test, _ = random_expression(rng)
+            matching = [item for item in pack if test(legacy_categories(item))]
+            checker.run(f"{label} {language} get_random_style_by_category({expression!r})", seed,
+                        lambda: legacy_engine.get_random_style_by_category("ALL", matching, language),
+                        lambda: ext.get_random_style_by_category(expression, engine_styles, language))
+
+    for _ in range(3):
+        language = rng.choice(LANGUAGES)
+        batch_size = rng.randint(1, 4)
+        n_iter = rng.randint(1, 3)
+        args = [
+            True,
+            rng.random() < 0.5,
+            rng.random() < 0.5,
+            random_text(rng) if rng.random() < 0.7 else "  ",
+            random_text(rng) if rng.random() < 0.7 else "",
+            *(random_style(rng, pack, language) for _ in range(4)),
+            language,
+            rng.choice(["ALL", "missing"] + CATEGORIES),
+            "",
+            "",
+        ]
+        prompt = random_text(rng)
+        negative_prompt = random_text(rng)
+
+        def run_process(process):
+            p = webui_stubs.FakeProcessing(prompt, negative_prompt, batch_size, n_iter, seed)
+            process(p, *args)
+            return p.all_prompts, p.all_negative_prompts, p.extra_generation_params
+
+        checker.run(f"{label} process{tuple(args)!r}", seed,
+                    lambda: run_process(legacy_engine.process), lambda: run_process(ext.StyleSelectorXL().process))
+
+
+def csv_fields(registry):
+    """樣式庫中 CSV 會保留的欄位（CSV 沒有 id 與 weight，空的在地化名稱讀回時為 None）"""
+    return [(record.name, record.prompt, record.negative_prompt or "",
+             tuple(registry.categories[category_id] for category_id in record.category_ids),
+             record.namezh or None, record.namejp or None)
+            for record in registry.records]
+
+
+def check_csv_round_trip(checker, label, pack):
+    """目前的樣式檔（v1 或 v2）匯出成 CSV 再讀回樣式庫，內容應與原本的樣式相同"""
+    ext = checker.ext
+    csv_path = ext.stylespath + ".csv"
+    count = ext.export_styles_csv(ext.stylespath, csv_path)
+    checker.compare(f"{label} export_styles_csv count", len(pack), count)
+    checker.compare(f"{label} CSV round trip", csv_fields(ext.StyleRegistry(pack)),
+                    csv_fields(ext.StyleRegistry(list(ext.iter_csv_styles(csv_path)))))
+
+
+class UploadedFile:
+    """gradio 上傳元件傳入的檔案物件（只用到 name）"""
+
+    def __init__(self, name):
+        self.name = name
+
+
+def check_iteration(checker, rng, directory, iteration):
+    ext = checker.ext
+    pack = make_pack(rng)
+    # 每次用新檔名，避免樣式庫快取因 mtime 解析度而沿用舊檔
+    legacy_path = os.path.join(directory, f"legacy_{iteration}.json")
+    with open(legacy_path, 'wt', encoding="utf-8") as file:
+        json.dump(pack, file, ensure_ascii=False)
+    pack_format = rng.choice(PACK_FORMATS)
+    legacy_engine.stylespath = legacy_path
+    ext.stylespath = write_pack(ext, os.path.join(directory, f"pack_{iteration}.json"), pack, pack_format)
+    check_pack(checker, rng, f"[{iteration} {pack_format}]", pack, pack)
+    check_csv_round_trip(checker, f"[{iteration} {pack_format}]", pack)
+
+    # 重新上傳修改過的樣式檔：目前的樣式庫以 apply_update 就地更新，之後的結果要與舊版讀新檔相同
+    edited = edit_pack(rng, pack)
+    legacy_path = os.path.join(directory, f"legacy_{iteration}_edited.json")
+    with open(legacy_path, 'wt', encoding="utf-8") as file:
+        json.dump(edited, file, ensure_ascii=False)
+    pack_format = rng.choice(PACK_FORMATS)
+    edited_path = write_pack(ext, os.path.join(directory, f"pack_{iteration}_edited.json"), edited, pack_format)
+    with contextlib.redirect_stdout(io.StringIO()):
+        status = ext.process_uploaded_json(UploadedFile(edited_path))[3]
+    # 與舊版相同：空的樣式檔回報讀取失敗，但仍會切換到該檔案
+    expected = "Successfully loaded" if edited else "Failed to parse JSON file"
+    checker.compare(f"[{iteration}] upload status", expected, status[:len(expected)])
+    legacy_engine.stylespath = legacy_path
+    check_pack(checker, rng, f"[{iteration} edited {pack_format}]", edited, ext.get_registry(ext.stylespath))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        with contextlib.redirect_stdout(io.StringIO()):
+            ext = webui_stubs.load_extension(basedir=directory)
+        checker = Checker(ext)
+        rng = random.Random(args.seed)
+        for iteration in range(args.iterations):
+            check_iteration(checker, rng, directory, iteration)
+            if checker.failures >= 20:
+                print("Too many mismatches, stopping early.")
+                break
+
+    if checker.failures:
+        print(f"{checker.failures} mismatches (seed {args.seed})")
+        return 1
+    print(f"{args.iterations} iterations, no mismatches (seed {args.seed})")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,121 @@
+"""
+Check that the ``Diverse`` random mode actually spreads a batch over dissimilar
+styles: build a synthetic library of template families (each family is a base
+tag list, its variants differ by one or two tags and tag order), then compare
+how many distinct families a batch covers with ``Diverse`` against ``Uniform``
+picking, and how many clusters the signatures produce for the synthetic and the
+bundled style packs.
+
+    python tools/diversity_coverage.py --families 50 --variants 20 --trials 200
+    python tools/diversity_coverage.py --families 200 --variants 10 --json coverage.json
+
+Exits with status 1 when the Diverse/Uniform coverage ratio is below ``--min-gain``
+(1.3 by default).
+"""
+import argparse
+import collections
+import contextlib
+import io
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+
+import webui_stubs
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BUNDLED_PACKS = ["sdxl_styles.json", "nsfw_styles.json"]
+
+
+def make_families(families, variants, tags_per_style, seed=0):
+    """回傳 (樣式清單, 每個樣式所屬的 family)；同一 family 的變體只差一兩個標籤與順序"""
+    rng = random.Random(seed)
+    vocabulary = [f"tag{i}" for i in range(families * tags_per_style * 4)]
+    items = []
+    family_of = {}
+    for family in range(families):
+        base = rng.sample(vocabulary, tags_per_style)
+        for variant in range(variants):
+            tags = list(base)
+            for _ in range(rng.randint(1, 2)):
+                tags[rng.randrange(len(tags))] = rng.choice(vocabulary)
+            rng.shuffle(tags)
+            name = f"family {family} variant {variant}"
+            items.append({"name": name, "prompt": "{prompt}, " + ", ".join(tags), "category": "synthetic"})
+            family_of[name] = family
+    return items, family_of
+
+
+def coverage(registry, family_of, batch, trials, seed):
+    """每種模式 trials 次抽一整批，回傳平均涵蓋的 family 數"""
+    rng = random.Random(seed)
+    uniform = []
+    diverse = []
+    for _ in range(trials):
+        uniform.append(len({family_of[registry.pick("ALL", rng).name] for _ in range(batch)}))
+        diverse.append(len({family_of[record.name] for record in registry.diverse_sample("ALL", batch, rng)}))
+    return statistics.mean(uniform), statistics.mean(diverse)
+
+
+def bundled_clusters(ext):
+    results = {}
+    for name in BUNDLED_PACKS:
+        path = os.path.join(REPO_DIR, name)
+        if os.path.exists(path):
+            registry = ext.get_registry(path)
+            results[name] = {"styles": len(registry), "clusters": len(registry.clusters("ALL"))}
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--families", type=int, default=50)
+    parser.add_argument("--variants", type=int, default=20, help="styles per family")
+    parser.add_argument("--tags", type=int, default=8, help="tags per template")
+    parser.add_argument("--batch", type=int, help="styles per batch (default: one per family)")
+    parser.add_argument("--trials", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--min-gain", type=float, default=1.3, help="minimum Diverse/Uniform coverage ratio")
+    parser.add_argument("--json", help="also write the report to this file")
+    args = parser.parse_args()
+    batch = args.batch or args.families
+
+    items, family_of = make_families(args.families, args.variants, args.tags, args.seed)
+    with tempfile.TemporaryDirectory() as directory:
+        with contextlib.redirect_stdout(io.StringIO()):
+            ext = webui_stubs.load_extension(basedir=directory)
+        registry = ext.StyleRegistry(items)
+        clusters = registry.clusters("ALL")
+        # 每群中出現最多的 family 佔該群的比例：群被誤合併時會下降
+        purity = sum(max(collections.Counter(family_of[record.name] for record in cluster).values())
+                     for cluster in clusters) / len(items)
+        uniform, diverse = coverage(registry, family_of, batch, args.trials, args.seed)
+        bundled = bundled_clusters(ext)
+
+    report = {
+        "families": args.families,
+        "styles": len(items),
+        "batch": batch,
+        "clusters": len(clusters),
+        "cluster_purity": round(purity, 3),
+        "uniform_coverage": round(uniform, 2),
+        "diverse_coverage": round(diverse, 2),
+        "gain": round(diverse / uniform, 3),
+        "bundled": bundled,
+    }
+    print(f"{report['styles']} styles in {args.families} families -> {report['clusters']} clusters "
+          f"(purity {report['cluster_purity']:.1%})")
+    print(f"families covered by a batch of {batch}: Uniform {uniform:.1f}, Diverse {diverse:.1f} "
+          f"(x{report['gain']:.2f})")
+    for name, stats in bundled.items():
+        print(f"{name}: {stats['styles']} styles -> {stats['clusters']} clusters")
+    if args.json:
+        with open(args.json, 'wt', encoding="utf-8") as file:
+            json.dump(report, file, indent=2)
+    return 1 if report["gain"] < args.min_gain else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,214 @@
+"""
+Frozen copy of the prompt-building logic of ``scripts/StyleSelectorXL.py`` as it
+was before the registry/engine rewrite. Used only as the reference by
+``differential_check.py``; do not change behaviour here.
+"""
+import json
+import random
+
+stylespath = ""
+current_language = "default"
+
+def get_json_content(file_path):
+    try:
+        with open(file_path, 'rt', encoding="utf-8") as file:
+            json_data = json.load(file)
+            return json_data
+    except Exception as e:
+        print(f"A Problem occurred: {str(e)}")
+
+
+def get_original_name_from_display(display_name, json_data, language="default"):
+    """根據顯示名稱找到原始名稱"""
+    for item in json_data:
+        if isinstance(item, dict) and 'name' in item:
+            if language == "chinese" and item.get('namezh') == display_name:
+                return item['name']
+            elif language == "japanese" and item.get('namejp') == display_name:
+                return item['name']
+            elif item['name'] == display_name:
+                return item['name']
+    return display_name
+
+
+def createPositive(style, positive):
+    json_data = get_json_content(stylespath)
+    try:
+        if not isinstance(json_data, list):
+            raise ValueError("Invalid JSON data. Expected a list of templates.")
+
+        # 如果選擇了 "Random Select"，隨機選擇一個樣式
+        if style == "Random Select":
+            available_styles = [item['name'] for item in json_data if isinstance(item, dict) and 'name' in item]
+            if available_styles:
+                style = random.choice(available_styles)
+            else:
+                return positive  # 如果沒有可用樣式，返回原始提示
+
+        # 根據顯示名稱找到原始名稱
+        original_name = get_original_name_from_display(style, json_data, current_language)
+        
+        for template in json_data:
+            if template.get('name') == original_name:
+                return template['prompt'].replace('{prompt}', positive)
+
+        raise ValueError(f"No template found with name '{style}'.")
+    except Exception as e:
+        print(f"An error occurred: {str(e)}")
+
+
+def createNegative(style, negative):
+    json_data = get_json_content(stylespath)
+    try:
+        if not isinstance(json_data, list):
+            raise ValueError("Invalid JSON data. Expected a list of templates.")
+
+        # 如果選擇了 "Random Select"，隨機選擇一個樣式
+        if style == "Random Select":
+            available_styles = [item['name'] for item in json_data if isinstance(item, dict) and 'name' in item]
+            if available_styles:
+                style = random.choice(available_styles)
+            else:
+                return negative  # 如果沒有可用樣式，返回原始提示
+
+        # 根據顯示名稱找到原始名稱
+        original_name = get_original_name_from_display(style, json_data, current_language)
+        
+        for template in json_data:
+            if template.get('name') == original_name:
+                json_negative_prompt = template.get('negative_prompt', "")
+                return f"{json_negative_prompt}, {negative}" if json_negative_prompt and negative else json_negative_prompt or negative
+
+        raise ValueError(f"No template found with name '{style}'.")
+    except Exception as e:
+        print(f"An error occurred: {str(e)}")
+
+
+def get_random_style_by_category(category, json_data, language="default"):
+    """根據category隨機選擇樣式"""
+    available_styles = []
+    
+    for item in json_data:
+        if isinstance(item, dict) and 'name' in item:
+            if category == "ALL":
+                # 從所有樣式中選擇
+                available_styles.append(item)
+            else:
+                # 從特定category中選擇
+                item_categories = []
+                if 'category' in item and item['category']:
+                    item_categories = [cat.strip() for cat in item['category'].split(',') if cat.strip()]
+                
+                if category in item_categories:
+                    available_styles.append(item)
+    
+    if available_styles:
+        selected_item = random.choice(available_styles)
+        # 根據語言返回對應的顯示名稱
+        if language == "chinese" and selected_item.get('namezh'):
+            return selected_item['namezh']
+        elif language == "japanese" and selected_item.get('namejp'):
+            return selected_item['namejp']
+        else:
+            return selected_item['name']
+    
+    return None
+        
+
+def process(p, is_enabled, style_at_beginning, use_current_prompt, current_prompt_text, current_neg_prompt_text, style1, style2, style3, style4, language_selector, random_category, file_status, upload_status):
+    if not is_enabled:
+        return
+
+    global current_language
+    current_language = language_selector
+
+    batchCount = len(p.all_prompts)
+
+    # Gather selected styles and handle Random Select
+    selected_styles = []
+    json_data = get_json_content(stylespath)
+    
+    for style in [style1, style2, style3, style4]:
+        if style and style != 'base':
+            if style == "Random Select":
+                # 根據Random Category進行隨機選擇
+                random_style = get_random_style_by_category(random_category, json_data, current_language)
+                if random_style:
+                    selected_styles.append(random_style)
+            else:
+                selected_styles.append(style)
+
+    print(f"Total batch count: {batchCount}")
+    print(f"Selected styles: {selected_styles}")
+    print(f"Random category: {random_category}")
+    print(f"Current language: {current_language}")
+
+    # Inject positive prompts
+    for i, original_prompt in enumerate(p.all_prompts):
+        injected_styles = [createPositive(s, "") for s in selected_styles if s]
+        injection_parts = []
+        
+        print(f"Processing prompt {i}: styles = {selected_styles}")
+        print(f"Injected styles for prompt {i}: {injected_styles}")
+        
+        # Add style prompts
+        style_injection = ", ".join([s for s in injected_styles if s]).strip(", ")
+        if style_injection:
+            injection_parts.append(style_injection)
+        
+        # Add current prompt text if enabled
+        if use_current_prompt and current_prompt_text and current_prompt_text.strip():
+            injection_parts.append(current_prompt_text.strip())
+        
+        # Combine all injections
+        injection = ", ".join(injection_parts)
+        
+        if injection:
+            if style_at_beginning:
+                p.all_prompts[i] = f"{injection}, {original_prompt}"
+            else:
+                p.all_prompts[i] = f"{original_prompt}, {injection}"
+            print(f"Final prompt {i}: {p.all_prompts[i]}")
+        else:
+            p.all_prompts[i] = original_prompt
+            print(f"No injection for prompt {i}: {p.all_prompts[i]}")
+
+    # Inject negative prompts
+    for i, original_prompt in enumerate(p.all_negative_prompts):
+        injected_styles = [createNegative(s, "") for s in selected_styles if s]
+        injection_parts = []
+        
+        print(f"Processing negative prompt {i}: styles = {selected_styles}")
+        print(f"Injected negative styles for prompt {i}: {injected_styles}")
+        
+        # Add style prompts
+        style_injection = ", ".join([s for s in injected_styles if s]).strip(", ")
+        if style_injection:
+            injection_parts.append(style_injection)
+        
+        # Add current negative prompt text if enabled
+        if use_current_prompt and current_neg_prompt_text and current_neg_prompt_text.strip():
+            injection_parts.append(current_neg_prompt_text.strip())
+        
+        # Combine all injections
+        injection = ", ".join(injection_parts)
+        
+        if injection:
+            if style_at_beginning:
+                p.all_negative_prompts[i] = f"{injection}, {original_prompt}"
+            else:
+                p.all_negative_prompts[i] = f"{original_prompt}, {injection}"
+            print(f"Final negative prompt {i}: {p.all_negative_prompts[i]}")
+        else:
+            p.all_negative_prompts[i] = original_prompt
+            print(f"No negative injection for prompt {i}: {p.all_negative_prompts[i]}")
+
+    # Metadata
+    p.extra_generation_params.update({
+        "Style Selector Enabled": True,
+        "Style Selector At Beginning": style_at_beginning,
+        "Style Selector Use Current Prompt": use_current_prompt,
+        "Style Selector Language": current_language,
+        "Style Selector Random Category": random_category,
+        "Style Selector Styles Used": ", ".join(selected_styles)
+    })
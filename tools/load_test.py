@@ -0,0 +1,241 @@
+"""
+Multi-user load test: drive concurrent ``process`` hooks, style pack uploads
+(``update_styles_from_uploaded_file``) and language switches (``update_language``)
+against the extension with stubbed ``modules``/``gradio``, then report throughput,
+p50/p99 latency per operation and how often one user's request was affected by
+another user's ``stylespath``/``current_language`` change.
+
+    python tools/load_test.py --generators 8 --uploaders 1 --switchers 2 --duration 5
+    python tools/load_test.py --json load_report.json
+
+Two packs with the same style names but different prompt markers are uploaded
+alternately, so a prompt built from the other pack (or a style that could not be
+resolved in the requested language) can be detected in the output.
+"""
+import argparse
+import contextlib
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import traceback
+
+import webui_stubs
+
+LANGUAGES = ["default", "chinese", "japanese"]
+
+
+def make_pack(marker, size):
+    """所有樣式包使用相同名稱，只有提示詞中的標記不同"""
+    return [{
+        "name": f"style {i}",
+        "namezh": f"風格 {i}",
+        "namejp": f"スタイル {i}",
+        "prompt": f"{{prompt}}, {marker} {i}",
+        "negative_prompt": f"{marker} negative {i}",
+        "category": ["photo", "anime", "cinematic"][i % 3],
+    } for i in range(size)]
+
+
+def percentile(samples, fraction):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class UploadedFile:
+    """gradio 上傳元件傳入的檔案物件（只用到 name）"""
+
+    def __init__(self, name):
+        self.name = name
+
+
+class LoadTest:
+    def __init__(self, ext, packs, styles_per_pack, seed):
+        self.ext = ext
+        self.packs = packs
+        self.markers = {path: marker for marker, path in packs}
+        self.styles_per_pack = styles_per_pack
+        self.seed = seed
+        self.lock = threading.Lock()
+        self.latencies = {"process": [], "upload": [], "language": []}
+        self.counters = {
+            "stylespath contamination": 0,
+            "language contamination": 0,
+            "unresolved styles": 0,
+            "errors": 0,
+        }
+        self.error_samples = []
+        self.stop = threading.Event()
+
+    def record(self, kind, seconds, **counts):
+        with self.lock:
+            self.latencies[kind].append(seconds)
+            for key, value in counts.items():
+                self.counters[key] += value
+
+    def record_error(self, kind):
+        with self.lock:
+            self.counters["errors"] += 1
+            if len(self.error_samples) < 5:
+                self.error_samples.append(f"{kind}: {traceback.format_exc(limit=3)}")
+
+    def generate(self, index):
+        ext = self.ext
+        rng = random.Random(self.seed * 1000 + index)
+        while not self.stop.is_set():
+            language = rng.choice(LANGUAGES)
+            styles = []
+            for _ in range(4):
+                roll = rng.random()
+                if roll < 0.3:
+                    styles.append("base")
+                elif roll < 0.4:
+                    styles.append("Random Select")
+                else:
+                    styles.append(f"{self.display_prefix(language)} {rng.randrange(self.styles_per_pack)}")
+            expected_marker = self.markers.get(ext.stylespath)
+            p = webui_stubs.FakeProcessing("subject", "", rng.randint(1, 4), 1, rng.getrandbits(32))
+
+            start = time.perf_counter()
+            try:
+                ext.StyleSelectorXL().process(p, True, False, False, "", "", *styles, language, "ALL", "", "")
+            except Exception:
+                self.record_error("process")
+                continue
+            elapsed = time.perf_counter() - start
+
+            # 這次請求實際用到的樣式包標記
+            wanted = sum(1 for style in styles if style != "base")
+            found = set()
+            resolved = 0
+            for prompt in p.all_prompts:
+                for marker in self.markers.values():
+                    count = prompt.count(marker)
+                    if count:
+                        found.add(marker)
+                        resolved = max(resolved, count)
+            self.record(
+                "process", elapsed,
+                **{
+                    "stylespath contamination": int(bool(found - {expected_marker}) or len(found) > 1),
+                    "language contamination": int(p.extra_generation_params.get("Style Selector Language") != language),
+                    "unresolved styles": int(resolved < wanted),
+                },
+            )
+
+    def display_prefix(self, language):
+        return {"default": "style", "chinese": "風格", "japanese": "スタイル"}[language]
+
+    def upload(self, index):
+        rng = random.Random(self.seed * 2000 + index)
+        paths = [path for _, path in self.packs]
+        while not self.stop.is_set():
+            file_obj = UploadedFile(rng.choice(paths))
+            start = time.perf_counter()
+            try:
+                self.ext.update_styles_from_uploaded_file(file_obj)
+            except Exception:
+                self.record_error("upload")
+                continue
+            self.record("upload", time.perf_counter() - start)
+            time.sleep(rng.uniform(0, 0.01))
+
+    def switch_language(self, index):
+        rng = random.Random(self.seed * 3000 + index)
+        while not self.stop.is_set():
+            start = time.perf_counter()
+            try:
+                self.ext.update_language(rng.choice(LANGUAGES))
+            except Exception:
+                self.record_error("language")
+                continue
+            self.record("language", time.perf_counter() - start)
+            time.sleep(rng.uniform(0, 0.005))
+
+    def run(self, generators, uploaders, switchers, duration):
+        threads = []
+        for role, count in ((self.generate, generators), (self.upload, uploaders), (self.switch_language, switchers)):
+            threads.extend(threading.Thread(target=role, args=(i,), daemon=True) for i in range(count))
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        time.sleep(duration)
+        self.stop.set()
+        for thread in threads:
+            thread.join()
+        return time.perf_counter() - start
+
+    def report(self, elapsed, options):
+        operations = {}
+        for kind, samples in self.latencies.items():
+            operations[kind] = {
+                "count": len(samples),
+                "throughput_per_s": round(len(samples) / elapsed, 1) if elapsed else 0.0,
+                "p50_ms": round(percentile(samples, 0.50) * 1000, 3),
+                "p99_ms": round(percentile(samples, 0.99) * 1000, 3),
+            }
+        return {
+            "options": options,
+            "elapsed_s": round(elapsed, 3),
+            "operations": operations,
+            "contamination": dict(self.counters),
+            "error_samples": self.error_samples,
+        }
+
+
+def print_report(report):
+    options = report["options"]
+    print(f"{options['generators']} generators, {options['uploaders']} uploaders, {options['switchers']} language switchers, "
+          f"{options['styles']} styles per pack, {report['elapsed_s']} s")
+    print(f"{'operation':<10} {'count':>8} {'ops/s':>10} {'p50 ms':>10} {'p99 ms':>10}")
+    for kind, stats in report["operations"].items():
+        print(f"{kind:<10} {stats['count']:>8} {stats['throughput_per_s']:>10} {stats['p50_ms']:>10} {stats['p99_ms']:>10}")
+    process_count = report["operations"]["process"]["count"]
+    for key, value in report["contamination"].items():
+        share = f" ({value / process_count:.1%} of process calls)" if process_count and key != "errors" else ""
+        print(f"{key}: {value}{share}")
+    for sample in report["error_samples"]:
+        print(sample)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--generators", type=int, default=8, help="concurrent process() callers")
+    parser.add_argument("--uploaders", type=int, default=1, help="concurrent style pack uploaders")
+    parser.add_argument("--switchers", type=int, default=2, help="concurrent language switchers")
+    parser.add_argument("--duration", type=float, default=5.0, help="seconds to run")
+    parser.add_argument("--styles", type=int, default=1000, help="styles per generated pack")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="also write the report to this file")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        packs = []
+        for marker in ("pack-a", "pack-b"):
+            path = os.path.join(directory, f"{marker}.json")
+            with open(path, 'wt', encoding="utf-8") as file:
+                json.dump(make_pack(marker, args.styles), file, ensure_ascii=False)
+            packs.append((marker, path))
+
+        # hook 會大量輸出到 stdout，測試期間全部丟棄
+        with open(os.devnull, 'wt') as devnull, contextlib.redirect_stdout(devnull):
+            ext = webui_stubs.load_extension(basedir=directory)
+            ext.stylespath = packs[0][1]
+            test = LoadTest(ext, packs, args.styles, args.seed)
+            elapsed = test.run(args.generators, args.uploaders, args.switchers, args.duration)
+
+    report = test.report(elapsed, {key: value for key, value in vars(args).items() if key != "json"})
+    print_report(report)
+    if args.json:
+        with open(args.json, 'wt', encoding="utf-8") as file:
+            json.dump(report, file, indent=2, ensure_ascii=False)
+    return 1 if report["contamination"]["errors"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,103 @@
+"""
+Minimal stand-ins for the Automatic1111 ``modules`` package and ``gradio`` so
+that ``scripts/StyleSelectorXL.py`` can be imported outside of the webui by the
+benchmark and harness scripts in this directory.
+"""
+import importlib.util
+import os
+import sys
+import types
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCRIPTS_DIR = os.path.join(REPO_DIR, "scripts")
+SCRIPT_PATH = os.path.join(SCRIPTS_DIR, "StyleSelectorXL.py")
+
+
+class _Component:
+    """Accepts any constructor arguments, event bindings and context usage."""
+
+    def __init__(self, *args, **kwargs):
+        self.args = args
+        self.kwargs = kwargs
+        self.value = kwargs.get("value")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: None
+
+    @staticmethod
+    def update(**kwargs):
+        return kwargs
+
+
+def _module(name, **attrs):
+    module = types.ModuleType(name)
+    module.__dict__.update(attrs)
+    return module
+
+
+def install(basedir=SCRIPTS_DIR):
+    """Register the stub modules in ``sys.modules`` (real ones are left alone)."""
+    if "gradio" not in sys.modules:
+        component_names = ("Group", "Accordion", "Row", "Column", "Checkbox", "Dropdown", "Markdown",
+                           "File", "Button", "Textbox", "Radio", "Number", "Slider", "HTML", "Tabs", "Tab")
+        gradio = _module("gradio", update=lambda **kwargs: kwargs, **{name: _Component for name in component_names})
+        sys.modules["gradio"] = gradio
+
+    if "modules" not in sys.modules:
+        callbacks = {}
+
+        def register(kind):
+            return lambda fn: callbacks.setdefault(kind, []).append(fn)
+
+        class Script:
+            def __init__(self):
+                pass
+
+        class OptionInfo:
+            def __init__(self, *args, **kwargs):
+                self.args = args
+
+        class Options:
+            def add_option(self, *args, **kwargs):
+                pass
+
+        scripts = _module("modules.scripts", Script=Script, AlwaysVisible=object(), basedir=lambda: basedir)
+        shared = _module("modules.shared", opts=Options(), OptionInfo=OptionInfo)
+        script_callbacks = _module("modules.script_callbacks", callbacks=callbacks,
+                                   on_ui_settings=register("ui_settings"), on_app_started=register("app_started"))
+        ui_components = _module("modules.ui_components", FormRow=_Component, FormColumn=_Component,
+                                FormGroup=_Component, ToolButton=_Component)
+        modules = _module("modules", scripts=scripts, shared=shared, script_callbacks=script_callbacks,
+                          ui_components=ui_components)
+        modules.__path__ = []
+        for module in (modules, scripts, shared, script_callbacks, ui_components):
+            sys.modules[module.__name__] = module
+
+
+def load_extension(name="StyleSelectorXL", basedir=SCRIPTS_DIR):
+    """Import ``scripts/StyleSelectorXL.py`` against the stubs and return the module."""
+    install(basedir)
+    spec = importlib.util.spec_from_file_location(name, SCRIPT_PATH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class FakeProcessing:
+    """The subset of ``StableDiffusionProcessing`` that the ``process`` hook touches."""
+
+    def __init__(self, prompt="", negative_prompt="", batch_size=1, n_iter=1, seed=1):
+        count = batch_size * n_iter
+        self.batch_size = batch_size
+        self.n_iter = n_iter
+        self.all_prompts = [prompt] * count
+        self.all_negative_prompts = [negative_prompt] * count
+        self.all_seeds = [seed + i for i in range(count)]
+        self.all_subseeds = [seed + i for i in range(count)]
+        self.extra_generation_params = {}